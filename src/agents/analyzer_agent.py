@@ -7,6 +7,7 @@ from langchain_openai import ChatOpenAI
 from src.agents.state import OverallState
 from src.prompts.analyzer import get_analyzer_prompt, get_analyzer_system_prompt
 from src.services.config import get_config
+from src.services.llm import primary_model_params
 from src.types import AnalyzerResponse, FlagItem
 
 logger = logging.getLogger(__name__)
@@ -15,10 +16,7 @@ logger = logging.getLogger(__name__)
 def analyzer_agent(state: OverallState) -> AnalyzerResponse:
     """Analyzer agent."""
     config = get_config()
-    model = ChatOpenAI(
-        model=config.model.chat_model,
-        temperature=config.model.temperature,
-    )
+    model = ChatOpenAI(**primary_model_params(config))
     system_prompt = get_analyzer_system_prompt()
 
     # Use hybrid retrieval selected chunks or limit to config top_k
@@ -1,4 +1,5 @@
 import logging
+from typing import Any
 
 from langchain_core.messages import SystemMessage
 from langchain_openai import ChatOpenAI
@@ -6,11 +7,27 @@ from openai import BadRequestError
 
 from src.agents.state import OverallState
 from src.prompts.composer import get_composer_prompt, get_composer_system_prompt
-from src.services.config import get_config
+from src.services.config import AlternativeModelConfig, get_config
+from src.services.llm import get_http_client
 from src.types import ComposerResponse
 
 logger = logging.getLogger(__name__)
 
+# Chat models that rejected reasoning_effort; later runs skip the doomed first request
+_REASONING_REJECTED: set[str] = set()
+
+
+def _build_model(alt: AlternativeModelConfig, with_reasoning: bool = True) -> ChatOpenAI:
+    """Build the composer chat model, optionally passing reasoning_effort."""
+    kwargs: dict[str, Any] = {
+        "model": alt.chat_model,
+        "temperature": alt.temperature,
+        "http_client": get_http_client(),
+    }
+    if with_reasoning:
+        kwargs["reasoning_effort"] = alt.reasoning_effort
+    return ChatOpenAI(**kwargs)
+
 
 def composer_agent(state: OverallState) -> ComposerResponse:
     """Composer agent."""
@@ -18,18 +35,14 @@ def composer_agent(state: OverallState) -> ComposerResponse:
     # Always use alternative model for composer (gpt-5)
     alt = config.alternative_model
     # Prefer explicit reasoning_effort per latest docs, with graceful fallback if unsupported.
+    with_reasoning = alt.chat_model not in _REASONING_REJECTED
     try:
-        model = ChatOpenAI(
-            model=alt.chat_model,
-            reasoning_effort=alt.reasoning_effort,
-            temperature=alt.temperature,
-        )
+        model = _build_model(alt, with_reasoning=with_reasoning)
     except TypeError:
         # If this SDK version doesn't accept reasoning_effort, fall back without it
-        model = ChatOpenAI(
-            model=alt.chat_model,
-            temperature=alt.temperature,
-        )
+        _REASONING_REJECTED.add(alt.chat_model)
+        with_reasoning = False
+        model = _build_model(alt, with_reasoning=False)
         logger.info("Composer: fallback without reasoning_effort due to TypeError")
     prompt = get_composer_prompt(state["verified"], state["project_context"])
     system_prompt = get_composer_system_prompt()
@@ -40,14 +53,12 @@ def composer_agent(state: OverallState) -> ComposerResponse:
     messages = [SystemMessage(content=full_prompt)]
     try:
         response_msg = model.invoke(messages)
-        logger.info("Composer: response received (reasoning_effort path)")
+        logger.info(f"Composer: response received (reasoning_effort={with_reasoning})")
     except BadRequestError as e:
         # If API rejects reasoning_effort, retry once without it
-        if "Unknown parameter" in str(e) or "reasoning_effort" in str(e):
-            model = ChatOpenAI(
-                model=alt.chat_model,
-                temperature=alt.temperature,
-            )
+        if with_reasoning and ("Unknown parameter" in str(e) or "reasoning_effort" in str(e)):
+            _REASONING_REJECTED.add(alt.chat_model)
+            model = _build_model(alt, with_reasoning=False)
             response_msg = model.invoke(messages)
             logger.info("Composer: fallback without reasoning_effort due to API error")
         else:
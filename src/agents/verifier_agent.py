@@ -6,6 +6,7 @@ from langchain_openai import ChatOpenAI
 from src.agents.state import OverallState
 from src.prompts.verifier import get_verifier_prompt, get_verifier_system_prompt
 from src.services.config import get_config
+from src.services.llm import primary_model_params
 from src.types import VerifierResponse
 
 logger = logging.getLogger(__name__)
@@ -14,10 +15,7 @@ logger = logging.getLogger(__name__)
 def verifier_agent(state: OverallState) -> VerifierResponse:
     """Verifier agent."""
     config = get_config()
-    model = ChatOpenAI(
-        model=config.model.chat_model,
-        temperature=config.model.temperature,
-    )
+    model = ChatOpenAI(**primary_model_params(config))
 
     # Generate prompt and get response
     prompt = get_verifier_prompt(state.get("candidates", []), state.get("chunks", []))
@@ -14,6 +14,12 @@ logger = logging.getLogger(__name__)
 # Note: logging configuration is handled by the CLI entrypoint; avoid setting it at import time here.
 
 
+def _write_json(path: str, data: Any) -> None:
+    """Write data as indented UTF-8 JSON."""
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+
+
 def normalize_date(date_str: str) -> dict[str, Any]:
     """Normalize hungarian date string and return epoch timestamp."""
     try:
@@ -266,8 +272,7 @@ def process_email_data(input_dir: str, output_dir: str) -> None:
         redactor = PIIRedactor(known_people=known_people)
 
         # Save colleagues data
-        with open(os.path.join(output_dir, "colleagues.json"), "w", encoding="utf-8") as f:
-            json.dump(colleagues_clean, f, ensure_ascii=False, indent=2)
+        _write_json(os.path.join(output_dir, "colleagues.json"), colleagues_clean)
 
         # Find and parse email files
         email_files = []
@@ -283,8 +288,7 @@ def process_email_data(input_dir: str, output_dir: str) -> None:
                 all_threads.append(thread_data)
 
         # Save threads data
-        with open(os.path.join(output_dir, "email_threads.json"), "w", encoding="utf-8") as f:
-            json.dump(all_threads, f, ensure_ascii=False, indent=2)
+        _write_json(os.path.join(output_dir, "email_threads.json"), all_threads)
 
         # Create and save chunks
         app_config = get_config()
@@ -294,8 +298,7 @@ def process_email_data(input_dir: str, output_dir: str) -> None:
             overlap=getattr(app_config.chunking, "overlap", 100),
         )
 
-        with open(os.path.join(output_dir, "chunks.json"), "w", encoding="utf-8") as f:
-            json.dump(chunks, f, ensure_ascii=False, indent=2)
+        _write_json(os.path.join(output_dir, "chunks.json"), chunks)
 
         # Save summary
         summary = {
@@ -305,8 +308,7 @@ def process_email_data(input_dir: str, output_dir: str) -> None:
             "date_processed": datetime.now().isoformat(),
         }
 
-        with open(os.path.join(output_dir, "summary.json"), "w", encoding="utf-8") as f:
-            json.dump(summary, f, ensure_ascii=False, indent=2)
+        _write_json(os.path.join(output_dir, "summary.json"), summary)
 
         logger.info(f"Processed {len(all_threads)} threads with {summary['total_emails']} emails")
 
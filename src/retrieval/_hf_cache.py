@@ -0,0 +1,106 @@
+"""
+Process-wide cache for the Hugging Face embedding tokenizer and model.
+VectorStore and HybridRetriever share one loaded copy instead of each deserializing the weights.
+"""
+
+from functools import lru_cache
+from pathlib import Path
+from typing import Any
+
+import torch
+from transformers import AutoModel, AutoTokenizer
+
+try:
+    from optimum.onnxruntime import ORTModelForFeatureExtraction  # type: ignore[import-not-found]
+except ImportError:  # Optional: only needed for the "onnx"/"tensorrt" embedding backends
+    ORTModelForFeatureExtraction = None
+
+# ONNX Runtime (CUDA, non-CUDA) execution providers per non-PyTorch embedding backend
+ORT_PROVIDERS = {
+    "onnx": ("CUDAExecutionProvider", "CPUExecutionProvider"),
+    "tensorrt": ("TensorrtExecutionProvider", "CPUExecutionProvider"),
+}
+
+# Pinned embedding model revision
+MODEL_REVISION = "c54f2e6e80b2d7b7de06f51cec4959f6b3e03418"
+
+
+def resolve_device(backend: str = "hf") -> torch.device:
+    """Pick the best available device: CUDA, then Apple MPS, else CPU.
+
+    MPS is only used by the PyTorch ("hf") backend; ONNX Runtime runs those models on
+    the CPU provider, so their inputs must stay on the CPU.
+    """
+    if torch.cuda.is_available():
+        return torch.device("cuda")
+    if backend == "hf" and hasattr(torch.backends, "mps") and torch.backends.mps.is_available():
+        return torch.device("mps")
+    return torch.device("cpu")
+
+
+@lru_cache(maxsize=4)
+def load_tokenizer(model_name: str) -> Any:
+    """Load (once per model name) the tokenizer for the embedding model."""
+    return AutoTokenizer.from_pretrained(
+        model_name,
+        trust_remote_code=False,
+        revision=MODEL_REVISION,
+    )
+
+
+@lru_cache(maxsize=4)
+def load_model(model_name: str, device: torch.device) -> Any:
+    """Load (once per model name and device) the embedding model in eval mode on the device."""
+    # Load weights directly in bf16 on CUDA rather than materializing FP32 first
+    model = AutoModel.from_pretrained(
+        model_name,
+        trust_remote_code=False,
+        revision=MODEL_REVISION,
+        torch_dtype=torch.bfloat16 if device.type == "cuda" else torch.float32,
+    )
+    # Inference only: no dropout and no autograd state on the weights
+    model.eval()
+    model.requires_grad_(False)
+    model.to(device)
+    return model
+
+
+@lru_cache(maxsize=4)
+def load_ort_model(model_name: str, device: torch.device, backend: str, export_dir: str) -> Any:
+    """Load (once per process) the embedding model as an ONNX Runtime session.
+
+    The model is exported to ONNX on first use and saved under export_dir, so later
+    processes load the exported graph directly.
+    """
+    if ORTModelForFeatureExtraction is None:
+        raise ImportError(f"The {backend!r} embedding backend requires optimum[onnxruntime]")
+    cuda_provider, cpu_provider = ORT_PROVIDERS[backend]
+    provider = cuda_provider if device.type == "cuda" else cpu_provider
+
+    onnx_dir = Path(export_dir) / model_name.replace("/", "--")
+    if (onnx_dir / "model.onnx").exists():
+        return ORTModelForFeatureExtraction.from_pretrained(onnx_dir, provider=provider)
+
+    model = ORTModelForFeatureExtraction.from_pretrained(
+        model_name, revision=MODEL_REVISION, export=True, provider=provider
+    )
+    model.save_pretrained(onnx_dir)
+    return model
+
+
+def load_embedding_model(
+    model_name: str, device: torch.device, backend: str, persist_directory: str
+) -> Any:
+    """Load the embedding model for the configured backend ("hf", "onnx" or "tensorrt")."""
+    if backend == "hf":
+        return load_model(model_name, device)
+    if backend in ORT_PROVIDERS:
+        return load_ort_model(model_name, device, backend, str(Path(persist_directory) / "onnx"))
+    raise ValueError(f"Unknown embedding backend: {backend!r}")
+
+
+def clear_cache() -> None:
+    """Drop cached tokenizers and models (tests, or to free memory)."""
+    load_tokenizer.cache_clear()
+    load_model.cache_clear()
+    load_ort_model.cache_clear()
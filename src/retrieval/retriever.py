@@ -2,16 +2,27 @@
 
 import logging
 import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from typing import Any
 
 os.environ.setdefault("TOKENIZERS_PARALLELISM", "false")
 import chromadb
+import numpy as np
 import torch
 from chromadb.config import Settings
-from transformers import AutoModel, AutoTokenizer
+
+from src.retrieval._hf_cache import load_embedding_model, load_tokenizer, resolve_device
+from src.retrieval.store import write_generation
+from src.services.config import compile_term_pattern, get_config
 
 logger = logging.getLogger(__name__)
 
+# Rows per collection.get call when scanning documents for the keyword prefilter
+PREFILTER_PAGE_SIZE = 1000
+# Largest candidate set ranked in-process; bigger sets use Chroma's id-filtered query
+MAX_EXACT_CANDIDATES = 512
+
 
 class HybridRetriever:
     """Hybrid retriever with keyword prefiltering and vector search."""
@@ -39,6 +50,11 @@ class HybridRetriever:
         self.client: Any | None = None
         self.collection: Any | None = None
         self.embedding_model: Any | None = None
+        self.device = torch.device("cpu")
+        # ((collection count, write generation), ids, documents) from the last prefilter scan
+        self._doc_cache: tuple[tuple[int, int], list[str], list[str | None]] | None = None
+        # Query embeddings (float32 bytes) keyed by whitespace-normalized query text
+        self._query_cache = lru_cache(maxsize=128)(self._embed_query_uncached)
 
     def initialize(self) -> None:
         """Initialize ChromaDB client and embedding model."""
@@ -48,31 +64,19 @@ class HybridRetriever:
             )
 
             # Load model
-            try:
-                from src.services.config import get_config
-
-                config = get_config()
-                model_name = config.embedding.model_name
-            except ImportError:
-                model_name = "Qwen/Qwen3-Embedding-0.6B"
-
-            self.tokenizer = AutoTokenizer.from_pretrained(
-                model_name,
-                trust_remote_code=False,
-                revision="c54f2e6e80b2d7b7de06f51cec4959f6b3e03418",
-            )
-            self.embedding_model = AutoModel.from_pretrained(
-                model_name,
-                trust_remote_code=False,
-                revision="c54f2e6e80b2d7b7de06f51cec4959f6b3e03418",
-            )
-            self.embedding_model.eval()
+            embedding_config = get_config().embedding
+            model_name = embedding_config.model_name
+
+            # GPU/MPS support: resolve the device once and reuse it for every query
+            self.device = resolve_device(embedding_config.backend)
 
-            # GPU/MPS support
-            if torch.cuda.is_available():
-                self.embedding_model.cuda()
-            elif hasattr(torch.backends, "mps") and torch.backends.mps.is_available():
-                self.embedding_model.to("mps")
+            # Tokenizer and weights are shared with any VectorStore in this process
+            self.tokenizer = load_tokenizer(model_name)
+            self.embedding_model = load_embedding_model(
+                model_name, self.device, embedding_config.backend, self.persist_directory
+            )
+            self._query_cache.cache_clear()
+            self._doc_cache = None
 
             self.collection = self.client.get_collection(name=self.collection_name)
             logger.info(f"Retriever initialized: {self.collection_name}")
@@ -81,29 +85,51 @@ class HybridRetriever:
             logger.error(f"Failed to initialize retriever: {e}")
             raise
 
+    def _load_documents(self, collection: Any) -> tuple[list[str], list[str | None]]:
+        """Fetch ids and documents for the whole collection, page by page.
+
+        Only documents are requested (no metadatas/embeddings). The result is reused
+        until the collection count changes or this process writes to a collection;
+        writes from other processes are picked up on the next initialize().
+        """
+        version = (collection.count(), write_generation())
+        if self._doc_cache is not None and self._doc_cache[0] == version:
+            return self._doc_cache[1], self._doc_cache[2]
+
+        ids: list[str] = []
+        documents: list[str | None] = []
+        offset = 0
+        while True:
+            page = collection.get(include=["documents"], limit=PREFILTER_PAGE_SIZE, offset=offset)
+            ids.extend(page["ids"])
+            documents.extend(page["documents"] or [])
+            if len(page["ids"]) < PREFILTER_PAGE_SIZE:
+                break
+            offset += PREFILTER_PAGE_SIZE
+
+        self._doc_cache = (version, ids, documents)
+        return ids, documents
+
     def keyword_prefilter(self, query: str) -> list[str]:
         """Perform keyword-based prefiltering."""
         try:
             if self.collection is None:
                 logger.error("Collection not initialized. Call initialize() first.")
                 return []
-            results = self.collection.get(include=["documents"])
-            if not results["documents"]:
+            ids, documents = self._load_documents(self.collection)
+            if not documents:
                 return []
 
-            relevant_ids = []
-            query_lower = query.lower()
-
-            for doc_id, document in zip(results["ids"], results["documents"], strict=False):
-                doc_lower = document.lower()
-
-                # Check for query terms or prefilter keywords
-                has_match = any(term in doc_lower for term in query_lower.split()) or any(
-                    keyword in doc_lower for keyword in self.prefilter_keywords
-                )
+            # Query terms and prefilter keywords scanned in one compiled pass per document
+            pattern = compile_term_pattern(tuple(query.lower().split() + self.prefilter_keywords))
+            if pattern is None:
+                return []
 
-                if has_match:
-                    relevant_ids.append(doc_id)
+            relevant_ids = [
+                doc_id
+                for doc_id, document in zip(ids, documents, strict=False)
+                if document and pattern.search(document)
+            ]
 
             logger.info(f"Prefilter found {len(relevant_ids)} chunks")
             return relevant_ids
@@ -112,28 +138,66 @@ class HybridRetriever:
             logger.error(f"Prefilter failed: {e}")
             return []
 
-    def generate_query_embedding(self, query: str) -> list[float]:
-        try:
-            if self.embedding_model is None:
-                raise RuntimeError("Embedding model not initialized. Call initialize() first.")
-            inputs = self.tokenizer(query, return_tensors="pt", truncation=True, max_length=512)
+    def _embed_query_uncached(self, query: str) -> bytes:
+        """Run the embedding model on a query and return the float32 vector as bytes."""
+        if self.embedding_model is None:
+            raise RuntimeError("Embedding model not initialized. Call initialize() first.")
+        inputs = self.tokenizer(query, return_tensors="pt", truncation=True, max_length=512)
+
+        inputs = {k: v.to(self.device, non_blocking=True) for k, v in inputs.items()}
 
-            # Move to device
-            if torch.cuda.is_available():
-                inputs = {k: v.cuda() for k, v in inputs.items()}
-            elif hasattr(torch.backends, "mps") and torch.backends.mps.is_available():
-                inputs = {k: v.to("mps") for k, v in inputs.items()}
+        with torch.inference_mode():
+            outputs = self.embedding_model(**inputs)
+            embedding = outputs.last_hidden_state.mean(dim=1).squeeze().float().cpu().numpy()
 
-            with torch.no_grad():
-                outputs = self.embedding_model(**inputs)
-                embedding = outputs.last_hidden_state.mean(dim=1).squeeze().cpu().numpy()
+        return embedding.tobytes()  # type: ignore[no-any-return]
 
-            return embedding.tolist()  # type: ignore[no-any-return]
+    def generate_query_embedding(self, query: str) -> list[float]:
+        try:
+            # Repeated queries (across agent steps) skip the transformer forward. Only
+            # whitespace is normalized: the embedding model is case-sensitive.
+            cached = self._query_cache(" ".join(query.split()))
+            return np.frombuffer(cached, dtype=np.float32).tolist()  # type: ignore[no-any-return]
 
         except Exception as e:
             logger.error(f"Embedding generation failed: {e}")
             raise
 
+    def _rank_candidates(
+        self, collection: Any, query_embedding: list[float], candidate_ids: list[str], top_k: int
+    ) -> dict[str, list[list[Any]]]:
+        """Rank candidate chunks by cosine similarity to the query with one matrix-vector product.
+
+        Returns the same nested layout as collection.query, with cosine distances to match
+        the collection's "hnsw:space" setting.
+        """
+        response = collection.get(
+            ids=candidate_ids, include=["documents", "metadatas", "embeddings"]
+        )
+        ids = response["ids"]
+        if not ids:
+            return {"ids": [[]], "documents": [[]], "metadatas": [[]], "distances": [[]]}
+
+        matrix = np.asarray(response["embeddings"], dtype=np.float32)
+        query_vec = np.asarray(query_embedding, dtype=np.float32)
+        query_vec /= np.linalg.norm(query_vec) or 1.0
+        norms = np.linalg.norm(matrix, axis=1)
+        norms[norms == 0] = 1.0
+        scores = (matrix @ query_vec) / norms
+
+        k = min(top_k, len(ids))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+
+        documents = response["documents"]
+        metadatas = response["metadatas"]
+        return {
+            "ids": [[ids[i] for i in top]],
+            "documents": [[documents[i] for i in top]],
+            "metadatas": [[metadatas[i] for i in top]],
+            "distances": [(1.0 - scores[top]).tolist()],
+        }
+
     def semantic_search(
         self, query: str, candidate_ids: list[str] | None = None, top_k: int = 10
     ) -> list[dict[str, Any]]:
@@ -144,26 +208,20 @@ class HybridRetriever:
         try:
             query_embedding = self.generate_query_embedding(query)
 
-            results = self.collection.query(
-                query_embeddings=[query_embedding],
-                n_results=top_k,
-                include=["documents", "metadatas", "distances"],
-            )
-
-            # Filter by candidate IDs if provided
-            if candidate_ids:
-                ids = results.get("ids", [[]])[0]
-                filtered_indices = [i for i, doc_id in enumerate(ids) if doc_id in candidate_ids]
-
-                if filtered_indices:
-                    for key in ["ids", "documents", "metadatas", "distances"]:
-                        if key in results and results[key]:
-                            results[key][0] = [results[key][0][i] for i in filtered_indices[:top_k]]
-                else:
-                    # No matches, return empty
-                    for key in ["ids", "documents", "metadatas", "distances"]:
-                        if key in results:
-                            results[key][0] = []
+            if candidate_ids and len(candidate_ids) <= MAX_EXACT_CANDIDATES:
+                # Score a small candidate set exactly with one matmul
+                results = self._rank_candidates(
+                    self.collection, query_embedding, candidate_ids, top_k
+                )
+            else:
+                # Large candidate sets stay inside Chroma: the search is restricted to their ids
+                # instead of pulling every candidate's embedding and document into memory
+                results = self.collection.query(
+                    query_embeddings=[query_embedding],
+                    n_results=top_k,
+                    include=["documents", "metadatas", "distances"],
+                    **({"ids": candidate_ids} if candidate_ids else {}),
+                )
 
             # Format results
             formatted_results = []
@@ -197,16 +255,23 @@ class HybridRetriever:
         try:
             k = top_k or self.top_k
 
-            # Keyword prefiltering
             candidate_ids = None
             if self.prefilter_keywords:
-                candidate_ids = self.keyword_prefilter(query)
+                # The keyword prefilter scan and the query embedding are independent, so run
+                # them concurrently; the embedding lands in the query cache for semantic_search.
+                with ThreadPoolExecutor(max_workers=1) as pool:
+                    embedding = pool.submit(self.generate_query_embedding, query)
+                    candidate_ids = self.keyword_prefilter(query)
+                    embedding.result()
                 if not candidate_ids:
                     logger.info("No prefilter candidates, using semantic search only")
 
-            # Semantic search
-            results = self.semantic_search(query, candidate_ids=candidate_ids, top_k=k)
+            # Candidates restrict the search; without any, fall back to the whole HNSW index
+            results = self.semantic_search(query, candidate_ids=candidate_ids or None, top_k=k)
             results.sort(key=lambda x: x["score"], reverse=True)
+            results = results[:k]
+            for rank, result in enumerate(results, start=1):
+                result["rank"] = rank
 
             logger.info(f"Retrieval: {len(results)} results")
             return results
@@ -5,28 +5,127 @@ import hashlib
 import json
 import logging
 import os
+from collections.abc import Iterable, Iterator
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from itertools import islice
 from pathlib import Path
 from typing import Any
 
 import chromadb
+import numpy as np
 import torch
 from chromadb.config import Settings
-from transformers import AutoModel, AutoTokenizer
+
+from src.retrieval._hf_cache import load_embedding_model, load_tokenizer, resolve_device
+from src.services.config import get_config
+
+try:
+    import ijson  # type: ignore[import-untyped]
+except ImportError:  # Optional: fall back to json.load when ijson is not installed
+    ijson = None
 
 logger = logging.getLogger(__name__)
 
+# Bumped after every collection write so in-process readers can drop cached documents
+_write_generation = 0
+
+
+def write_generation() -> int:
+    """Return a counter that changes whenever this process writes to a collection."""
+    return _write_generation
+
+
+def _mean_pool(hidden: torch.Tensor, attention_mask: torch.Tensor) -> torch.Tensor:
+    """Mean-pool token states over real tokens only, ignoring padding."""
+    mask = attention_mask.unsqueeze(-1).to(hidden.dtype)
+    return (hidden * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1)
+
+
+def _bucketed_batches(
+    lengths: list[int], max_batch_size: int, max_tokens_per_batch: int
+) -> list[np.ndarray]:
+    """Group text positions into length-sorted batches under a padded-token budget.
+
+    Positions are sorted by token length and packed greedily: a batch is closed when
+    adding the next text would exceed max_batch_size or push batch_size * padded_length
+    past max_tokens_per_batch. A single text longer than the budget gets its own batch.
+    """
+    order = np.argsort(lengths, kind="stable")
+    batches: list[np.ndarray] = []
+    start = 0
+    for end in range(1, len(order) + 1):
+        size = end - start
+        next_width = lengths[order[end]] if end < len(order) else 0
+        if (
+            end == len(order)
+            or size == max_batch_size
+            or (size + 1) * next_width > max_tokens_per_batch
+        ):
+            batches.append(order[start:end])
+            start = end
+    return batches
+
+
+_SCALAR_TYPES = (str, int, float, bool)
+
+
+def _prepare_metadata(metadata: dict[str, Any]) -> dict[str, Any]:
+    """Prepare metadata for ChromaDB storage."""
+    prepared: dict[str, Any] = {}
+    for key, value in metadata.items():
+        # Exact type checks keep the common str/list-of-str path cheap
+        value_type = type(value)
+        if value_type is list:
+            try:
+                prepared[key] = ", ".join(value)
+            except TypeError:
+                prepared[key] = ", ".join(map(str, value))
+        elif value is None or value_type in _SCALAR_TYPES:
+            prepared[key] = value
+        else:
+            prepared[key] = str(value)
+    return prepared
+
+
+@lru_cache(maxsize=4)
+def _maybe_compile(model: Any, device: torch.device) -> Any:
+    """Compile the embedding model forward on CUDA (once per model), falling back to eager mode.
+
+    Set DISABLE_TORCH_COMPILE=1 to always use the eager model.
+    """
+    if (
+        device.type != "cuda"
+        or not isinstance(model, torch.nn.Module)
+        or os.getenv("DISABLE_TORCH_COMPILE") == "1"
+    ):
+        return model
+    try:
+        # dynamic=True avoids a recompile for every new padded sequence length
+        return torch.compile(model, mode="reduce-overhead", dynamic=True)
+    except Exception as e:
+        logger.warning(f"torch.compile unavailable, using eager model: {e}")
+        return model
+
 
 class VectorStore:
     """ChromaDB-based vector store for email chunks."""
 
     def __init__(
-        self, collection_name: str = "email_chunks", persist_directory: str = ".vectorstore"
+        self,
+        collection_name: str = "email_chunks",
+        persist_directory: str = ".vectorstore",
+        store_documents: bool = True,
     ):
         self.collection_name = collection_name
         self.persist_directory = persist_directory
+        # Raw text is needed by keyword prefiltering and the Chroma chunk loader;
+        # disable only for embedding-only indexes where chunks.json stays the source.
+        self.store_documents = store_documents
         self.client: Any | None = None
         self.collection: Any | None = None
         self.embedding_model: Any | None = None
+        self.device = torch.device("cpu")
 
     def initialize(self) -> None:
         """Initialize ChromaDB client and embedding model."""
@@ -36,34 +135,36 @@ class VectorStore:
             )
 
             # Load model
-            try:
-                from src.services.config import get_config
+            config = get_config()
+            model_name = config.embedding.model_name
+            collection_metadata = {
+                "hnsw:space": "cosine",
+                "hnsw:construction_ef": config.embedding.hnsw_construction_ef,
+                "hnsw:M": config.embedding.hnsw_m,
+                "hnsw:batch_size": config.embedding.hnsw_batch_size,
+                "hnsw:sync_threshold": config.embedding.hnsw_sync_threshold,
+            }
 
-                config = get_config()
-                model_name = config.embedding.model_name
-            except ImportError:
-                model_name = "Qwen/Qwen3-Embedding-0.6B"
+            # GPU/MPS support: resolve the device once and reuse it for every batch
+            self.device = resolve_device(config.embedding.backend)
 
-            self.tokenizer = AutoTokenizer.from_pretrained(
-                model_name,
-                trust_remote_code=False,
-                revision="c54f2e6e80b2d7b7de06f51cec4959f6b3e03418",
+            # Tokenizer and weights are shared with any HybridRetriever in this process
+            self.tokenizer = load_tokenizer(model_name)
+            self.embedding_model = load_embedding_model(
+                model_name, self.device, config.embedding.backend, self.persist_directory
             )
-            self.embedding_model = AutoModel.from_pretrained(
-                model_name,
-                trust_remote_code=False,
-                revision="c54f2e6e80b2d7b7de06f51cec4959f6b3e03418",
-            )
-            self.embedding_model.eval()
-
-            # GPU/MPS support
-            if torch.cuda.is_available():
-                self.embedding_model.cuda()
-            elif torch.backends.mps.is_available():
-                self.embedding_model.to("mps")
+            model = self.embedding_model
+            self.embedding_model = _maybe_compile(model, self.device)
+            if self.embedding_model is not model and not getattr(
+                self.embedding_model, "_warmed_up", False
+            ):
+                # Pay the compilation cost here rather than on the first real batch; the
+                # compiled wrapper is cached per process, so later stores skip this.
+                self.generate_embeddings(["warmup"])
+                self.embedding_model._warmed_up = True
 
             self.collection = self.client.get_or_create_collection(
-                name=self.collection_name, metadata={"hnsw:space": "cosine"}
+                name=self.collection_name, metadata=collection_metadata
             )
 
             logger.info(f"Vector store initialized: {self.collection_name}")
@@ -72,116 +173,189 @@ class VectorStore:
             logger.error(f"Failed to initialize vector store: {e}")
             raise
 
-    def load_chunks(self, chunks_file: str) -> list[dict[str, Any]]:
-        """Load chunks from JSON file."""
-        try:
-            with open(chunks_file, encoding="utf-8") as f:
-                chunks = json.load(f)
+    def iter_chunks(self, chunks_file: str) -> Iterator[dict[str, Any]]:
+        """Stream chunks from a JSON array file, one chunk at a time."""
+        with open(chunks_file, "rb") as f:
+            if ijson is not None:
+                yield from ijson.items(f, "item", use_float=True)
+                return
+
+            logger.warning("ijson is not installed; loading the whole chunks file into memory")
+            chunks = json.load(f)
             if isinstance(chunks, list):
-                logger.info(f"Loaded {len(chunks)} chunks from {chunks_file}")
-                return chunks
+                yield from chunks
             else:
                 logger.warning(f"Loaded data is not a list: {type(chunks)}")
-                return []
+
+    def load_chunks(self, chunks_file: str) -> list[dict[str, Any]]:
+        """Load chunks from JSON file."""
+        try:
+            chunks = list(self.iter_chunks(chunks_file))
+            logger.info(f"Loaded {len(chunks)} chunks from {chunks_file}")
+            return chunks
         except Exception as e:
             logger.error(f"Failed to load chunks from {chunks_file}: {e}")
             raise
 
     def generate_embeddings(
-        self, texts: list[str], embed_batch_size: int = 32
-    ) -> list[list[float]]:
+        self, texts: list[str], embed_batch_size: int = 32, max_tokens_per_batch: int = 8192
+    ) -> np.ndarray:
+        """Embed texts into one contiguous float32 (len(texts), dim) array, in input order."""
         try:
-            all_embeddings = []
-
-            for i in range(0, len(texts), embed_batch_size):
-                sub_texts = texts[i : i + embed_batch_size]
-                inputs = self.tokenizer(
-                    sub_texts, return_tensors="pt", padding=True, truncation=True, max_length=512
-                )
-
-                # Move to device
-                if torch.cuda.is_available():
-                    inputs = {k: v.cuda() for k, v in inputs.items()}
-                elif hasattr(torch.backends, "mps") and torch.backends.mps.is_available():
-                    inputs = {k: v.to("mps") for k, v in inputs.items()}
-
-                with torch.no_grad():
-                    if self.embedding_model is None:
-                        raise RuntimeError(
-                            "Embedding model not initialized. Call initialize() first."
-                        )
+            if self.embedding_model is None:
+                raise RuntimeError("Embedding model not initialized. Call initialize() first.")
+            if not texts:
+                return np.empty((0, 0), dtype=np.float32)
+
+            # Empty/whitespace texts keep a zero row instead of a wasted forward pass
+            keep_idx = np.array([i for i, text in enumerate(texts) if text.strip()], dtype=np.intp)
+            if not keep_idx.size:
+                dim = self.embedding_model.config.hidden_size
+                return np.zeros((len(texts), dim), dtype=np.float32)
+
+            # Tokenize every text once (unpadded), then embed in token-length order so
+            # each micro-batch pads only to its own longest text; scatter back after.
+            token_ids = self.tokenizer(
+                [texts[i] for i in keep_idx], truncation=True, max_length=512
+            )["input_ids"]
+            batches = _bucketed_batches(
+                [len(ids) for ids in token_ids], embed_batch_size, max_tokens_per_batch
+            )
+            all_embeddings: np.ndarray | None = None
+
+            for positions in batches:
+                inputs = self._pad_token_ids([token_ids[p] for p in positions])
+                inputs = {k: v.to(self.device, non_blocking=True) for k, v in inputs.items()}
+
+                # Weights are already bf16 on CUDA (see _hf_cache.load_model), so no autocast;
+                # Chroma persists FP32 regardless, so pooling is done in FP32.
+                with torch.inference_mode():
                     outputs = self.embedding_model(**inputs)
-                    batch_embeddings = outputs.last_hidden_state.mean(dim=1).cpu().numpy()
+                hidden = outputs.last_hidden_state.float()
+                pooled = _mean_pool(hidden, inputs["attention_mask"]).cpu().numpy()
 
-                all_embeddings.extend([vec.tolist() for vec in batch_embeddings])
+                # Rows are written straight into one preallocated block; no per-row lists
+                if all_embeddings is None:
+                    all_embeddings = np.zeros((len(texts), pooled.shape[1]), dtype=np.float32)
+                all_embeddings[keep_idx[positions]] = pooled
 
-            return all_embeddings
+            return all_embeddings  # type: ignore[return-value]
 
         except Exception as e:
             logger.error(f"Failed to generate embeddings: {e}")
             raise
 
-    def _prepare_metadata(self, metadata: dict[str, Any]) -> dict[str, Any]:
-        """Prepare metadata for ChromaDB storage."""
-        prepared = {}
-        for key, value in metadata.items():
-            if isinstance(value, list):
-                prepared[key] = ", ".join(str(item) for item in value)
-            else:
-                prepared[key] = value
-        return prepared
+    def _pad_token_ids(self, token_ids: list[list[int]]) -> dict[str, torch.Tensor]:
+        """Pad pre-tokenized ids into input_ids/attention_mask tensors, honoring padding_side."""
+        pad_id = getattr(self.tokenizer, "pad_token_id", None) or 0
+        left = getattr(self.tokenizer, "padding_side", "right") == "left"
+        width = max(len(ids) for ids in token_ids)
+        input_ids = torch.full((len(token_ids), width), pad_id, dtype=torch.long)
+        attention_mask = torch.zeros((len(token_ids), width), dtype=torch.long)
+        for row, ids in enumerate(token_ids):
+            span = slice(width - len(ids), width) if left else slice(0, len(ids))
+            input_ids[row, span] = torch.tensor(ids, dtype=torch.long)
+            attention_mask[row, span] = 1
+        return {"input_ids": input_ids, "attention_mask": attention_mask}
 
     @staticmethod
     def compute_chunk_hash(chunk: dict[str, Any]) -> str:
         """Compute hash for chunk."""
-        text = chunk.get("text", "")
-        return hashlib.sha256(text.encode()).hexdigest()[:16]
+        return VectorStore.compute_chunk_hashes([chunk])[0]
+
+    @staticmethod
+    def compute_chunk_hashes(chunks: Iterable[dict[str, Any]]) -> list[str]:
+        """Compute hashes for many chunks in one pass.
+
+        Uses the same truncated SHA-256 as the chunker's ids; hashlib's OpenSSL
+        backend picks up SHA-NI where the CPU has it.
+        """
+        sha256 = hashlib.sha256
+        return [sha256(chunk.get("text", "").encode()).hexdigest()[:16] for chunk in chunks]
 
     def upsert_batch(
         self,
         ids: list[str],
         texts: list[str],
         metadatas: list[dict[str, Any]],
-        embeddings: list[list[float]],
+        embeddings: np.ndarray | list[list[float]],
     ) -> None:
         """Upsert batch into collection."""
         if self.collection is None:
             raise RuntimeError("Collection not initialized. Call initialize() first.")
 
+        records: dict[str, Any] = {"embeddings": embeddings, "metadatas": metadatas, "ids": ids}
+        if self.store_documents:
+            records["documents"] = texts
+
         try:
             if hasattr(self.collection, "upsert"):
-                self.collection.upsert(
-                    documents=texts, embeddings=embeddings, metadatas=metadatas, ids=ids
-                )
+                self.collection.upsert(**records)
             else:
-                self.collection.add(
-                    documents=texts, embeddings=embeddings, metadatas=metadatas, ids=ids
-                )
+                self.collection.add(**records)
         except Exception as e:
             logger.warning(f"Upsert failed, falling back to add: {e}")
-            self.collection.add(
-                documents=texts, embeddings=embeddings, metadatas=metadatas, ids=ids
-            )
+            self.collection.add(**records)
+        finally:
+            global _write_generation
+            _write_generation += 1
 
-    def store_chunks(
-        self, chunks: list[dict[str, Any]], batch_size: int = 100, embed_batch_size: int = 32
-    ) -> None:
-        """Store chunks with embeddings in ChromaDB."""
-        try:
-            total_chunks = len(chunks)
-            logger.info(f"Storing {total_chunks} chunks...")
+    def _drop_existing(self, batch: list[dict[str, Any]]) -> list[dict[str, Any]]:
+        """Drop chunks whose id is repeated in the batch or already in the collection.
 
-            for i in range(0, total_chunks, batch_size):
-                batch = chunks[i : i + batch_size]
-                texts = [chunk["text"] for chunk in batch]
-                ids = [chunk["id"] for chunk in batch]
-                metadatas = [self._prepare_metadata(chunk["metadata"]) for chunk in batch]
-                embeddings = self.generate_embeddings(texts, embed_batch_size=embed_batch_size)
+        Chunk ids embed a digest of the chunk text, so a stored id means identical text.
+        """
+        if self.collection is None:
+            raise RuntimeError("Collection not initialized. Call initialize() first.")
+        ids = [chunk["id"] for chunk in batch]
+        existing = set(self.collection.get(ids=ids, include=[])["ids"])
+        fresh: dict[str, dict[str, Any]] = {}
+        for chunk_id, chunk in zip(ids, batch, strict=True):
+            if chunk_id not in existing:
+                fresh.setdefault(chunk_id, chunk)
+        return list(fresh.values())
 
-                self.upsert_batch(ids=ids, texts=texts, metadatas=metadatas, embeddings=embeddings)
-                logger.info(f"Stored batch {i//batch_size + 1}")
+    def store_chunks(
+        self,
+        chunks: Iterable[dict[str, Any]],
+        batch_size: int = 100,
+        embed_batch_size: int = 32,
+        skip_existing: bool = False,
+    ) -> int:
+        """Store chunks with embeddings in ChromaDB.
+
+        Accepts any iterable so chunks can be streamed from disk; only one
+        batch is held in memory at a time. With skip_existing, chunks already
+        in the collection are not re-embedded. Returns the number of chunks stored.
+        """
+        try:
+            logger.info("Storing chunks...")
+            chunk_iter = iter(chunks)
+            total_chunks = 0
+            batch_num = 0
+
+            # Metadata is prepared on a worker thread while the batch is being embedded
+            with ThreadPoolExecutor(max_workers=1) as pool:
+                while batch := list(islice(chunk_iter, batch_size)):
+                    if skip_existing and not (batch := self._drop_existing(batch)):
+                        continue
+                    texts = [chunk["text"] for chunk in batch]
+                    ids = [chunk["id"] for chunk in batch]
+                    metadata_future = pool.submit(
+                        list, map(_prepare_metadata, [chunk["metadata"] for chunk in batch])
+                    )
+                    embeddings = self.generate_embeddings(texts, embed_batch_size=embed_batch_size)
+                    metadatas = metadata_future.result()
+
+                    self.upsert_batch(
+                        ids=ids, texts=texts, metadatas=metadatas, embeddings=embeddings
+                    )
+                    total_chunks += len(batch)
+                    batch_num += 1
+                    logger.info(f"Stored batch {batch_num}")
 
             logger.info(f"Stored {total_chunks} chunks")
+            return total_chunks
 
         except Exception as e:
             logger.error(f"Failed to store chunks: {e}")
@@ -212,13 +386,19 @@ def process_chunks_to_vectorstore(
     vectorstore_dir: str,
     collection_name: str = "email_chunks",
     batch_size: int = 100,
+    store_documents: bool = True,
+    skip_existing: bool = False,
 ) -> dict[str, Any]:
     """Process chunks from input directory and store in vector database."""
     try:
         os.makedirs(vectorstore_dir, exist_ok=True)
 
         # Initialize vector store
-        store = VectorStore(collection_name=collection_name, persist_directory=vectorstore_dir)
+        store = VectorStore(
+            collection_name=collection_name,
+            persist_directory=vectorstore_dir,
+            store_documents=store_documents,
+        )
         store.initialize()
 
         # Load chunks
@@ -226,12 +406,12 @@ def process_chunks_to_vectorstore(
         if not chunks_file.exists():
             raise FileNotFoundError(f"chunks.json not found in {input_dir}")
 
-        chunks = store.load_chunks(str(chunks_file))
-
-        # Store all chunks
-        if chunks:
-            store.store_chunks(chunks, batch_size=batch_size)
-            logger.info(f"Stored {len(chunks)} chunks")
+        # Stream chunks straight into the store
+        stored = store.store_chunks(
+            store.iter_chunks(str(chunks_file)), batch_size=batch_size, skip_existing=skip_existing
+        )
+        if stored:
+            logger.info(f"Stored {stored} chunks")
         else:
             logger.info("No chunks to store")
 
@@ -253,6 +433,16 @@ def main() -> None:
     parser.add_argument(
         "--vectorstore-dir", type=str, default=".vectorstore", help="Directory for vector store"
     )
+    parser.add_argument(
+        "--no-documents",
+        action="store_true",
+        help="Store only embeddings and metadata (disables keyword prefiltering on this index)",
+    )
+    parser.add_argument(
+        "--skip-existing",
+        action="store_true",
+        help="Only embed chunks whose ids are not already in the collection",
+    )
 
     args = parser.parse_args()
 
@@ -262,6 +452,8 @@ def main() -> None:
         info = process_chunks_to_vectorstore(
             input_dir=args.input_dir,
             vectorstore_dir=args.vectorstore_dir,
+            store_documents=not args.no_documents,
+            skip_existing=args.skip_existing,
         )
 
         print("Vector store creation successful!")
@@ -3,9 +3,12 @@ Configuration management for the multi-agent risk reporter.
 Loads settings from YAML files and environment variables.
 """
 
+import copy
 import logging
 import os
+import re
 from dataclasses import dataclass, field
+from functools import lru_cache
 from pathlib import Path
 from typing import Any
 
@@ -17,8 +20,27 @@ logger = logging.getLogger(__name__)
 # Load environment variables
 load_dotenv()
 
+# Prefer libyaml's C loader; fall back to the pure-Python loader when unavailable
+_YAML_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
 
-@dataclass
+# Parsed YAML keyed by (absolute path, mtime_ns, size) so unchanged files are not reparsed
+_YAML_CACHE: dict[tuple[str, int, int], dict[str, Any]] = {}
+
+
+@lru_cache(maxsize=32)
+def compile_term_pattern(terms: tuple[str, ...]) -> re.Pattern[str] | None:
+    """Compile keyword terms into one case-insensitive alternation regex.
+
+    Longer terms are tried first so multi-word phrases win over their prefixes.
+    Returns None when there is nothing to match.
+    """
+    unique = sorted({t for t in terms if t}, key=len, reverse=True)
+    if not unique:
+        return None
+    return re.compile("|".join(map(re.escape, unique)), re.IGNORECASE)
+
+
+@dataclass(slots=True)
 class ModelConfig:
     """Configuration for LLM models."""
 
@@ -28,14 +50,21 @@ class ModelConfig:
     max_output_tokens: int = 50000
 
 
-@dataclass
+@dataclass(slots=True)
 class EmbeddingConfig:
     """Configuration for embedding models."""
 
     model_name: str = "Qwen/Qwen3-Embedding-0.6B"
+    # Inference backend: "hf" (PyTorch), "onnx" or "tensorrt" (ONNX Runtime via optimum)
+    backend: str = "hf"
+    # HNSW index tuning, applied when the Chroma collection is first created
+    hnsw_construction_ef: int = 100
+    hnsw_m: int = 16
+    hnsw_batch_size: int = 1000
+    hnsw_sync_threshold: int = 10000
 
 
-@dataclass
+@dataclass(slots=True)
 class AgentModelsConfig:
     """Configuration for agent-specific models."""
 
@@ -44,7 +73,7 @@ class AgentModelsConfig:
     composer: str = "alternative_model"  # Report generation (can use more capable model)
 
 
-@dataclass
+@dataclass(slots=True)
 class AlternativeModelConfig:
     """Configuration for alternative model."""
 
@@ -55,7 +84,7 @@ class AlternativeModelConfig:
     max_output_tokens: int = 50000
 
 
-@dataclass
+@dataclass(slots=True)
 class RetrievalConfig:
     """Configuration for retrieval system."""
 
@@ -84,8 +113,15 @@ class RetrievalConfig:
         ]
     )
 
+    def match(self, text: str) -> list[str]:
+        """Return the prefilter keywords found in text, in order of first appearance."""
+        pattern = compile_term_pattern(tuple(self.prefilter_keywords))
+        if pattern is None:
+            return []
+        return list(dict.fromkeys(m.group(0).lower() for m in pattern.finditer(text)))
+
 
-@dataclass
+@dataclass(slots=True)
 class ChunkingConfig:
     """Configuration for text chunking."""
 
@@ -93,7 +129,7 @@ class ChunkingConfig:
     overlap: int = 100  # Overlap tokens between chunks
 
 
-@dataclass
+@dataclass(slots=True)
 class FlagsConfig:
     """Configuration for risk flags."""
 
@@ -133,9 +169,22 @@ class FlagsConfig:
             ]
         }
     )
+    # Casefolded critical terms, built once in __post_init__ for O(1) membership checks
+    _erb_term_set: frozenset[str] = field(
+        default_factory=frozenset, init=False, repr=False, compare=False
+    )
+
+    def __post_init__(self) -> None:
+        """Precompute the casefolded ERB critical-term set."""
+        terms = self.erb.get("critical_terms") or []
+        self._erb_term_set = frozenset(t.casefold() for t in terms if isinstance(t, str))
 
+    def is_critical_term(self, term: str) -> bool:
+        """Check whether a term (any case) is one of the ERB critical terms."""
+        return term.casefold() in self._erb_term_set
 
-@dataclass
+
+@dataclass(slots=True)
 class ScoringConfig:
     """Configuration for scoring system."""
 
@@ -144,14 +193,14 @@ class ScoringConfig:
     role_weight: float = 1.0
 
 
-@dataclass
+@dataclass(slots=True)
 class ReportConfig:
     """Configuration for report generation."""
 
     top_n_per_project: int = 5
 
 
-@dataclass
+@dataclass(slots=True)
 class AppConfig:
     """Main application configuration."""
 
@@ -195,9 +244,17 @@ class ConfigManager:
     def load_from_yaml(yaml_path: str) -> dict[str, Any]:
         """Load configuration from YAML file."""
         try:
-            with open(yaml_path, encoding="utf-8") as f:
-                result = yaml.safe_load(f)
-                return result if isinstance(result, dict) else {}
+            # Binary mode lets the YAML reader decode UTF-8 itself instead of TextIOWrapper
+            with open(yaml_path, "rb") as f:
+                st = os.fstat(f.fileno())
+                key = (os.path.abspath(yaml_path), st.st_mtime_ns, st.st_size)
+                cached = _YAML_CACHE.get(key)
+                if cached is None:
+                    result = yaml.load(f, Loader=_YAML_LOADER)  # nosec B506 - safe loader
+                    cached = result if isinstance(result, dict) else {}
+                    _YAML_CACHE[key] = cached
+            # Callers build config objects from nested lists/dicts; keep the cache pristine
+            return copy.deepcopy(cached)
         except FileNotFoundError:
             logger.warning(f"Configuration file {yaml_path} not found, using defaults")
             return {}
@@ -217,72 +274,70 @@ class ConfigManager:
             # Start with default configuration
             config = AppConfig()
 
-            # Load model configuration
+            # Load model configuration; load_from_yaml handles a missing file
             model_path = Path(config_dir) / model_config_file
-            if model_path.exists():
-                model_data = cls.load_from_yaml(str(model_path))
-                if model_data:
-                    # Load primary model config
-                    if "primary_model" in model_data:
-                        primary_data = cls._filter_dataclass_kwargs(
-                            ModelConfig, model_data["primary_model"]
-                        )
-                        config.model = ModelConfig(**primary_data)
-
-                    # Load embedding config
-                    if "embedding_model" in model_data:
-                        embedding_data = cls._filter_dataclass_kwargs(
-                            EmbeddingConfig, model_data["embedding_model"]
-                        )
-                        config.embedding = EmbeddingConfig(**embedding_data)
-
-                    # Load alternative model config
-                    if "alternative_model" in model_data:
-                        alt_data = cls._filter_dataclass_kwargs(
-                            AlternativeModelConfig, model_data["alternative_model"]
-                        )
-                        config.alternative_model = AlternativeModelConfig(**alt_data)
-                    # Always ensure alternative model is present
-                    if not getattr(config, "alternative_model", None):
-                        config.alternative_model = AlternativeModelConfig()
-
-                    # Load agent models config
-                    if "agent_models" in model_data:
-                        agent_data = cls._filter_dataclass_kwargs(
-                            AgentModelsConfig, model_data["agent_models"]
-                        )
-                        config.agent_models = AgentModelsConfig(**agent_data)
+            model_data = cls.load_from_yaml(str(model_path))
+            if model_data:
+                # Load primary model config
+                if "primary_model" in model_data:
+                    primary_data = cls._filter_dataclass_kwargs(
+                        ModelConfig, model_data["primary_model"]
+                    )
+                    config.model = ModelConfig(**primary_data)
+
+                # Load embedding config
+                if "embedding_model" in model_data:
+                    embedding_data = cls._filter_dataclass_kwargs(
+                        EmbeddingConfig, model_data["embedding_model"]
+                    )
+                    config.embedding = EmbeddingConfig(**embedding_data)
+
+                # Load alternative model config
+                if "alternative_model" in model_data:
+                    alt_data = cls._filter_dataclass_kwargs(
+                        AlternativeModelConfig, model_data["alternative_model"]
+                    )
+                    config.alternative_model = AlternativeModelConfig(**alt_data)
+                # Always ensure alternative model is present
+                if not getattr(config, "alternative_model", None):
+                    config.alternative_model = AlternativeModelConfig()
+
+                # Load agent models config
+                if "agent_models" in model_data:
+                    agent_data = cls._filter_dataclass_kwargs(
+                        AgentModelsConfig, model_data["agent_models"]
+                    )
+                    config.agent_models = AgentModelsConfig(**agent_data)
 
             # Load pipeline configuration
             pipeline_path = Path(config_dir) / pipeline_config_file
-            if pipeline_path.exists():
-                pipeline_data = cls.load_from_yaml(str(pipeline_path))
-
-                if pipeline_data:
-                    # Update retrieval config
-                    if "retrieval" in pipeline_data:
-                        ret_data = pipeline_data["retrieval"]
-                        config.retrieval = RetrievalConfig(**ret_data)
-
-                    # Update chunking config
-                    if "chunking" in pipeline_data:
-                        chunk_data = pipeline_data["chunking"]
-                        config.chunking = ChunkingConfig(**chunk_data)
-
-                    # Update flags config
-                    if "flags" in pipeline_data:
-                        flags_data = pipeline_data["flags"]
-                        config.flags = FlagsConfig(**flags_data)
-
-                    # Update scoring config
-                    if "scoring" in pipeline_data:
-                        scoring_data = pipeline_data["scoring"]
-                        config.scoring = ScoringConfig(**scoring_data)
-
-                    # Update report config
-                    if "report" in pipeline_data:
-                        report_data = pipeline_data["report"]
-                        config.report = ReportConfig(**report_data)
+            pipeline_data = cls.load_from_yaml(str(pipeline_path))
+
+            if pipeline_data:
+                # Update retrieval config
+                if "retrieval" in pipeline_data:
+                    ret_data = pipeline_data["retrieval"]
+                    config.retrieval = RetrievalConfig(**ret_data)
+
+                # Update chunking config
+                if "chunking" in pipeline_data:
+                    chunk_data = pipeline_data["chunking"]
+                    config.chunking = ChunkingConfig(**chunk_data)
+
+                # Update flags config
+                if "flags" in pipeline_data:
+                    flags_data = pipeline_data["flags"]
+                    config.flags = FlagsConfig(**flags_data)
+
+                # Update scoring config
+                if "scoring" in pipeline_data:
+                    scoring_data = pipeline_data["scoring"]
+                    config.scoring = ScoringConfig(**scoring_data)
+
+                # Update report config
+                if "report" in pipeline_data:
+                    report_data = pipeline_data["report"]
+                    config.report = ReportConfig(**report_data)
 
             # Override with environment variables
             config.openai_api_key = os.getenv("OPENAI_API_KEY")
@@ -313,7 +368,7 @@ class ConfigManager:
             issues.append("OPENAI_API_KEY is required but not set")
 
         # Check paths exist
-        if not Path(config.data_raw).exists():
+        if not os.access(config.data_raw, os.F_OK):
             issues.append(f"Data raw directory does not exist: {config.data_raw}")
 
         # Check model configuration
@@ -331,23 +386,17 @@ class ConfigManager:
         return issues
 
 
-# Global configuration instance
-_app_config: AppConfig | None = None
-
-
+@lru_cache(maxsize=1)
 def get_config() -> AppConfig:
-    """Get the global application configuration."""
-    global _app_config
-    if _app_config is None:
-        _app_config = ConfigManager.load_config()
-    return _app_config
+    """Get the global application configuration (loaded once, cleared by reload_config)."""
+    return ConfigManager.load_config()
 
 
 def reload_config() -> AppConfig:
     """Reload configuration from files."""
-    global _app_config
-    _app_config = ConfigManager.load_config()
-    return _app_config
+    _YAML_CACHE.clear()
+    get_config.cache_clear()
+    return get_config()
 
 
 def validate_current_config() -> list[str]:
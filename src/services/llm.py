@@ -0,0 +1,47 @@
+"""
+Shared LLM client plumbing for the agents.
+Keeps one HTTP connection pool alive across analyzer, verifier and composer calls.
+"""
+
+from collections.abc import Mapping
+from functools import lru_cache
+from types import MappingProxyType
+from typing import TYPE_CHECKING, Any
+
+from src.services.config import AppConfig
+
+if TYPE_CHECKING:
+    from openai import DefaultHttpxClient
+
+
+@lru_cache(maxsize=1)
+def get_http_client() -> "DefaultHttpxClient":
+    """Get the process-wide HTTP client shared by every ChatOpenAI instance.
+
+    Agents build a ChatOpenAI per invocation; passing this client keeps the
+    keep-alive pool and TLS sessions warm instead of re-creating them per call.
+    The openai import is deferred so importing this module stays cheap.
+    """
+    from openai import DefaultHttpxClient
+
+    return DefaultHttpxClient()
+
+
+@lru_cache(maxsize=8)
+def _primary_model_template(model: str, temperature: float) -> Mapping[str, Any]:
+    """Build the read-only ChatOpenAI keyword arguments for one model/temperature pair."""
+    return MappingProxyType(
+        {
+            "model": model,
+            "temperature": temperature,
+            "http_client": get_http_client(),
+        }
+    )
+
+
+def primary_model_params(config: AppConfig) -> Mapping[str, Any]:
+    """Get the ChatOpenAI keyword arguments for the primary (analyzer/verifier) model.
+
+    The template is built once per (chat_model, temperature) and shared read-only.
+    """
+    return _primary_model_template(config.model.chat_model, config.model.temperature)
@@ -84,18 +84,3 @@ class VerifierResponse(TypedDict):
 
 class ComposerResponse(TypedDict):
     report: str
-
-
-# Configuration types
-class ModelConfig(TypedDict, total=False):
-    provider: str
-    chat_model: str
-    temperature: float
-    max_output_tokens: int
-
-
-class PipelineConfig(TypedDict, total=False):
-    retrieval: dict[str, Any]
-    flags: dict[str, Any]
-    scoring: dict[str, Any]
-    report: dict[str, Any]
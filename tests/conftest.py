@@ -2,23 +2,20 @@
 Pytest configuration and shared fixtures for the multi-agent risk reporter tests.
 """
 
+import copy
 import os
-import shutil
-import tempfile
 from unittest.mock import Mock, patch
 
 import pytest
 
-from src.services.config import AppConfig
+from src.ingestion.pii import PIIRedactor
+from src.services.config import AppConfig, get_config, reload_config
 from src.types import Chunk, EmailData, ThreadData
 
 
-@pytest.fixture
-def temp_dir():
-    """Create a temporary directory for tests."""
-    temp_path = tempfile.mkdtemp()
-    yield temp_path
-    shutil.rmtree(temp_path, ignore_errors=True)
+def pytest_configure(config):
+    """Register custom markers (pytest.ini's [tool:pytest] section is not read from pytest.ini)."""
+    config.addinivalue_line("markers", "smoke: Fast CI smoke tests (imports, config, basics)")
 
 
 @pytest.fixture(scope="session")
@@ -40,6 +37,20 @@ def mock_config():
     return config
 
 
+@pytest.fixture(scope="session")
+def pii_redactor():
+    """PII redactor with one known person; it holds no per-call state, so it is shared."""
+    return PIIRedactor(
+        known_people={
+            "john.smith@company.com": {
+                "person_id": "john_smith_developer",
+                "name": "John Smith",
+                "role": "Developer",
+            }
+        }
+    )
+
+
 @pytest.fixture(scope="session")
 def sample_email_data():
     """Sample email data for testing."""
@@ -74,8 +85,8 @@ def sample_thread_data(sample_email_data):
 
 
 @pytest.fixture(scope="session")
-def sample_chunks():
-    """Sample chunks for testing."""
+def _sample_chunks_canonical():
+    """Canonical sample chunks, built once per session; never handed to tests directly."""
     chunks = []
 
     # Chunk 1 - ERB type (Emerging Risk/Blocker)
@@ -142,6 +153,21 @@ def sample_chunks():
     return chunks
 
 
+@pytest.fixture
+def sample_chunks(_sample_chunks_canonical):
+    """Sample chunks for testing; a deep copy so tests may mutate them freely."""
+    return copy.deepcopy(_sample_chunks_canonical)
+
+
+@pytest.fixture(scope="session")
+def compiled_graph():
+    """Compiled LangGraph pipeline, built once per session."""
+    # Imported here so tests that never touch the graph do not load langgraph
+    from src.agents.graph import create_graph
+
+    return create_graph()
+
+
 @pytest.fixture(scope="session")
 def mock_openai_response():
     """Mock OpenAI response for testing."""
@@ -164,9 +190,12 @@ items:
     return mock_response
 
 
-@pytest.fixture(autouse=True)
+@pytest.fixture(scope="session", autouse=True)
 def mock_env_vars():
-    """Mock environment variables for tests."""
+    """Mock environment variables once for the whole test session.
+
+    Keeps a developer's real OPENAI_API_KEY, DEBUG_LOGS or REPORT_DIR out of every test.
+    """
     with patch.dict(
         os.environ,
         {
@@ -178,7 +207,10 @@ def mock_env_vars():
             "REPORT_DIR": "./test_reports",
         },
     ):
+        # Drop any config cached before the patch so get_config() sees the test environment
+        reload_config()
         yield
+    get_config.cache_clear()
 
 
 @pytest.fixture
@@ -213,7 +245,7 @@ def mock_chroma_client():
 @pytest.fixture
 def mock_huggingface_model():
     """Mock HuggingFace model for testing."""
-    with patch("src.retrieval.store.AutoModel") as mock_model_class:
+    with patch("src.retrieval._hf_cache.AutoModel") as mock_model_class:
         mock_model = Mock()
         mock_model.eval.return_value = None
         mock_model.cuda.return_value = mock_model
@@ -227,7 +259,7 @@ def mock_huggingface_model():
 @pytest.fixture
 def mock_tokenizer():
     """Mock tokenizer for testing."""
-    with patch("src.retrieval.store.AutoTokenizer") as mock_tokenizer_class:
+    with patch("src.retrieval._hf_cache.AutoTokenizer") as mock_tokenizer_class:
         mock_tokenizer = Mock()
         mock_tokenizer.__call__.return_value = {
             "input_ids": [[1, 2, 3, 4, 5]],
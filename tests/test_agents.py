@@ -3,31 +3,46 @@ Critical tests for agent functionality.
 Tests essential analyzer, verifier, composer agents for PoC.
 """
 
+from contextlib import ExitStack
+from types import SimpleNamespace
 from unittest.mock import Mock, patch
 
+import httpx
+import pytest
+from openai import BadRequestError
+
 from src.agents.analyzer_agent import analyzer_agent
 from src.agents.composer_agent import composer_agent
-from src.agents.graph import create_graph
 from src.agents.state import OverallState
 from src.agents.verifier_agent import verifier_agent
+from src.services.config import AppConfig
+from src.services.llm import get_http_client, primary_model_params
+
+
+@pytest.fixture(scope="module")
+def _composer_patches():
+    """Patch the composer's collaborators once for the whole module."""
+    with ExitStack() as stack:
+        yield SimpleNamespace(
+            get_config=stack.enter_context(patch("src.agents.composer_agent.get_config")),
+            chat_openai=stack.enter_context(patch("src.agents.composer_agent.ChatOpenAI")),
+            get_prompt=stack.enter_context(patch("src.agents.composer_agent.get_composer_prompt")),
+            system_prompt=stack.enter_context(
+                patch("src.agents.composer_agent.get_composer_system_prompt")
+            ),
+        )
 
 
-class TestAnalyzerAgent:
-    """Test critical analyzer agent functionality."""
+@pytest.fixture
+def patched_composer(_composer_patches):
+    """Get the module-wide composer mocks, reset for this test."""
+    for mock in vars(_composer_patches).values():
+        mock.reset_mock(return_value=True, side_effect=True)
+    return _composer_patches
 
-    @patch("src.agents.analyzer_agent.ChatOpenAI")
-    @patch("src.agents.analyzer_agent.get_analyzer_prompt")
-    @patch("src.agents.analyzer_agent.get_analyzer_system_prompt")
-    def test_analyzer_agent_success(
-        self, mock_system_prompt, mock_get_prompt, mock_chat_openai, mock_config, sample_chunks
-    ):
-        """Test successful analyzer agent execution."""
-        # Setup mocks
-        mock_system_prompt.return_value = "System prompt"
-        mock_get_prompt.return_value = "Test prompt"
 
-        mock_response = Mock()
-        mock_response.content = """
+# Canned model responses shared by the analyzer and verifier tests
+_ERB_YAML = """
 items:
   - label: "erb"
     title: "Database connectivity issue"
@@ -42,9 +57,58 @@ items:
     confidence: "high"
     score: 0.9
 """
-        mock_model_instance = Mock()
-        mock_model_instance.invoke.return_value = mock_response
-        mock_chat_openai.return_value = mock_model_instance
+
+_VERIFIED_YAML = """
+verified:
+  - label: "erb"
+    title: "Database connectivity issue"
+    reason: "Application is blocked"
+    owner_hint: "Database team"
+    next_step: "Investigate connection"
+    evidence:
+      - file: "test.txt"
+        lines: "1-5"
+    thread_id: "thread_001"
+    timestamp: "2024-01-15T10:30:00"
+    confidence: "high"
+    score: 0.9
+"""
+
+_REPORT_MD = "# Test Report\nContent here"
+
+
+def fake_chat(content: str) -> SimpleNamespace:
+    """Build a cheap stand-in chat model whose invoke() returns a message with content."""
+    return SimpleNamespace(invoke=lambda *args, **kwargs: SimpleNamespace(content=content))
+
+
+class Recorder:
+    """Stand-in ChatOpenAI class that records constructor kwargs and returns fake_chat models."""
+
+    def __init__(self, content: str):
+        self.content = content
+        self.calls: list[dict] = []
+
+    def __call__(self, **kwargs):
+        self.calls.append(kwargs)
+        return fake_chat(self.content)
+
+
+class TestAnalyzerAgent:
+    """Test critical analyzer agent functionality."""
+
+    @patch("src.agents.analyzer_agent.ChatOpenAI")
+    @patch("src.agents.analyzer_agent.get_analyzer_prompt")
+    @patch("src.agents.analyzer_agent.get_analyzer_system_prompt")
+    def test_analyzer_agent_success(
+        self, mock_system_prompt, mock_get_prompt, mock_chat_openai, mock_config, sample_chunks
+    ):
+        """Test successful analyzer agent execution."""
+        # Setup mocks
+        mock_system_prompt.return_value = "System prompt"
+        mock_get_prompt.return_value = "Test prompt"
+
+        mock_chat_openai.return_value = fake_chat(_ERB_YAML)
 
         # Create test state
         state = OverallState(
@@ -59,6 +123,17 @@ items:
         assert len(result["items"]) == 1
         assert result["items"][0]["label"] == "erb"
         assert result["items"][0]["title"] == "Database connectivity issue"
+        # Agents share one pooled HTTP client rather than opening a new one per call
+        assert mock_chat_openai.call_args.kwargs["http_client"] is get_http_client()
+
+    def test_primary_model_params_built_once(self, mock_config):
+        """Test the primary model template is built once per config and is read-only."""
+        params = primary_model_params(mock_config)
+
+        assert primary_model_params(mock_config) is params
+        assert params["model"] == mock_config.model.chat_model
+        with pytest.raises(TypeError):
+            params["temperature"] = 1.0  # type: ignore[index]
 
 
 class TestVerifierAgent:
@@ -75,25 +150,7 @@ class TestVerifierAgent:
         mock_system_prompt.return_value = "System prompt"
         mock_get_prompt.return_value = "Test prompt"
 
-        mock_response = Mock()
-        mock_response.content = """
-verified:
-  - label: "erb"
-    title: "Database connectivity issue"
-    reason: "Application is blocked"
-    owner_hint: "Database team"
-    next_step: "Investigate connection"
-    evidence:
-      - file: "test.txt"
-        lines: "1-5"
-    thread_id: "thread_001"
-    timestamp: "2024-01-15T10:30:00"
-    confidence: "high"
-    score: 0.9
-"""
-        mock_model_instance = Mock()
-        mock_model_instance.invoke.return_value = mock_response
-        mock_chat_openai.return_value = mock_model_instance
+        mock_chat_openai.return_value = fake_chat(_VERIFIED_YAML)
 
         # Create test state
         candidates = [
@@ -118,44 +175,23 @@ verified:
 class TestComposerAgent:
     """Test critical composer agent functionality."""
 
-    @patch("src.services.config.get_config")
-    @patch("src.agents.composer_agent.ChatOpenAI")
-    @patch("src.agents.composer_agent.get_composer_prompt")
-    @patch("src.agents.composer_agent.get_composer_system_prompt")
-    def test_composer_agent_success(
-        self,
-        mock_system_prompt,
-        mock_get_prompt,
-        mock_chat_openai,
-        mock_get_config,
+    @pytest.mark.parametrize(
+        "composer_model, expected_model",
+        [("primary_model", "gpt-5"), ("alternative_model", "gpt-5")],
+    )
+    def test_composer_agent_model_selection(
+        self, patched_composer, monkeypatch, composer_model, expected_model
     ):
-        """Test successful composer agent execution."""
-        # Setup mocks
-        mock_system_prompt.return_value = "System prompt"
-        mock_get_prompt.return_value = "Test prompt"
-
-        # Setup mock config
-        from src.services.config import (
-            AgentModelsConfig,
-            AlternativeModelConfig,
-            AppConfig,
-            ModelConfig,
-        )
-
+        """Test the composer reports through the alternative model whatever agent_models says."""
         test_config = AppConfig()
-        test_config.agent_models = AgentModelsConfig()
-        test_config.model = ModelConfig()
-        test_config.alternative_model = AlternativeModelConfig()
-
-        test_config.agent_models.composer = "primary_model"
+        test_config.agent_models.composer = composer_model
         test_config.model.chat_model = "gpt-5-mini"
-        mock_get_config.return_value = test_config
-
-        mock_response = Mock()
-        mock_response.content = "# Risk Report\n- Database issue found"
-        mock_model_instance = Mock()
-        mock_model_instance.invoke.return_value = mock_response
-        mock_chat_openai.return_value = mock_model_instance
+        test_config.alternative_model.chat_model = "gpt-5"
+        patched_composer.get_config.return_value = test_config
+        patched_composer.system_prompt.return_value = "System prompt"
+        patched_composer.get_prompt.return_value = "Test prompt"
+        recorder = Recorder(_REPORT_MD)
+        monkeypatch.setattr("src.agents.composer_agent.ChatOpenAI", recorder)
 
         verified = [
             {
@@ -166,122 +202,46 @@ class TestComposerAgent:
                 "score": 0.9,
             }
         ]
-
         state = OverallState(verified=verified, project_context="Test project")
 
         result = composer_agent(state)
 
-        # Verify results
-        assert "report" in result
-        assert "# Risk Report" in result["report"]
-        assert "Database issue" in result["report"]
-
+        assert result["report"] == _REPORT_MD
+        assert len(recorder.calls) == 1
+        assert recorder.calls[0]["model"] == expected_model
 
-class TestGraph:
-    """Test critical graph functionality."""
-
-    def test_create_graph_structure(self):
-        """Test graph creation and structure."""
-        graph = create_graph()
-
-        # Verify graph has the expected nodes
-        assert graph is not None
-
-    @patch("src.services.config.get_config")
-    @patch("src.agents.composer_agent.ChatOpenAI")
-    @patch("src.agents.composer_agent.get_composer_prompt")
-    @patch("src.agents.composer_agent.get_composer_system_prompt")
-    def test_composer_agent_model_selection(
-        self,
-        mock_system_prompt,
-        mock_get_prompt,
-        mock_chat_openai,
-        mock_config,
+    @patch("src.agents.composer_agent._REASONING_REJECTED", new_callable=set)
+    def test_composer_agent_remembers_rejected_reasoning_effort(
+        self, rejected, patched_composer, mock_config
     ):
-        """Test composer agent model selection logic."""
-        # Setup mocks
-        mock_system_prompt.return_value = "System prompt"
-        mock_get_prompt.return_value = "Test prompt"
-
-        mock_response = Mock()
-        mock_response.content = "# Test Report\nContent here"
-        mock_model_instance = Mock()
-        mock_model_instance.invoke.return_value = mock_response
-        mock_chat_openai.return_value = mock_model_instance
-
-        # Test with alternative model selection
-        mock_config.agent_models.composer = "alternative_model"
-        mock_config.alternative_model.chat_model = "gpt-5"
-
-        verified = [
-            {
-                "label": "erb",
-                "title": "Test issue",
-                "evidence": [{"file": "test.txt", "lines": "1-5"}],
-                "confidence": "high",
-                "score": 0.9,
-            }
-        ]
-
-        state = OverallState(verified=verified, project_context="Test project")
-
-        result = composer_agent(state)
-
-        # Verify results
-        assert "report" in result
-        assert result["report"] == "# Test Report\nContent here"
-
-        # Verify alternative model was used
-        mock_chat_openai.assert_called_once()
-        call_args = mock_chat_openai.call_args
-        assert call_args.kwargs["model"] == "gpt-5"
-
-    @patch("src.services.config.get_config")
-    @patch("src.agents.composer_agent.ChatOpenAI")
-    @patch("src.agents.composer_agent.get_composer_prompt")
-    @patch("src.agents.composer_agent.get_composer_system_prompt")
-    def test_composer_agent_primary_model_selection(
-        self,
-        mock_system_prompt,
-        mock_get_prompt,
-        mock_chat_openai,
-        mock_get_config,
-    ):
-        """Test composer agent uses primary model when configured."""
-        # Setup mocks
-        mock_system_prompt.return_value = "System prompt"
-        mock_get_prompt.return_value = "Test prompt"
-
-        # Setup mock config
-        from src.services.config import (
-            AgentModelsConfig,
-            AlternativeModelConfig,
-            AppConfig,
-            ModelConfig,
+        """Test a model that rejects reasoning_effort is called without it afterwards."""
+        patched_composer.get_config.return_value = mock_config
+        patched_composer.get_prompt.return_value = "Test prompt"
+        rejecting = Mock()
+        rejecting.invoke.side_effect = BadRequestError(
+            "Unknown parameter: reasoning_effort",
+            response=httpx.Response(400, request=httpx.Request("POST", "https://api.test")),
+            body=None,
         )
+        accepting = fake_chat("# Report")
+        patched_composer.chat_openai.side_effect = [rejecting, accepting, accepting]
 
-        test_config = AppConfig()
-        test_config.agent_models = AgentModelsConfig()
-        test_config.model = ModelConfig()
-        test_config.alternative_model = AlternativeModelConfig()
+        state = OverallState(verified=[], project_context="Test project")
+        assert composer_agent(state)["report"] == "# Report"
+        assert composer_agent(state)["report"] == "# Report"
 
-        test_config.agent_models.composer = "primary_model"
-        test_config.model.chat_model = "gpt-5-mini"
-        test_config.alternative_model.chat_model = "gpt-5"
-        mock_get_config.return_value = test_config
+        assert rejected == {mock_config.alternative_model.chat_model}
+        kwargs = [c.kwargs for c in patched_composer.chat_openai.call_args_list]
+        assert "reasoning_effort" in kwargs[0]
+        assert all("reasoning_effort" not in k for k in kwargs[1:])
 
-        mock_response = Mock()
-        mock_response.content = "# Test Report\nContent here"
-        mock_model_instance = Mock()
-        mock_model_instance.invoke.return_value = mock_response
-        mock_chat_openai.return_value = mock_model_instance
 
-        verified = []
-        state = OverallState(verified=verified, project_context="Test project")
+class TestGraph:
+    """Test critical graph functionality."""
 
-        composer_agent(state)
+    def test_create_graph_structure(self, compiled_graph):
+        """Test graph creation and structure."""
+        assert compiled_graph is not None
 
-        # Verify alternative model was used (composer forces alternative)
-        mock_chat_openai.assert_called_once()
-        call_args = mock_chat_openai.call_args
-        assert call_args.kwargs["model"] == "gpt-5"
+        # Verify graph has the expected nodes
+        assert {"analyzer", "map_items", "verifier", "composer"} <= set(compiled_graph.nodes)
@@ -5,13 +5,17 @@ Tests the essential ConfigManager and AppConfig functionality for PoC.
 
 import os
 
-from src.services.config import ConfigManager
+import pytest
+import yaml
+
+from src.services import config as config_module
+from src.services.config import ConfigManager, FlagsConfig, RetrievalConfig, reload_config
 
 
 class TestConfigManager:
     """Test critical ConfigManager functionality."""
 
-    def test_load_from_yaml_valid_file(self, temp_dir):
+    def test_load_from_yaml_valid_file(self, tmp_path):
         """Test loading configuration from a valid YAML file."""
         yaml_content = """
 primary_model:
@@ -24,7 +28,7 @@ embedding_model:
   model_name: "Qwen/Qwen3-Embedding-0.6B"
 """
 
-        yaml_path = os.path.join(temp_dir, "test_config.yaml")
+        yaml_path = os.path.join(tmp_path, "test_config.yaml")
         with open(yaml_path, "w") as f:
             f.write(yaml_content)
 
@@ -39,7 +43,22 @@ embedding_model:
         result = ConfigManager.load_from_yaml("/nonexistent/path.yaml")
         assert result == {}
 
-    def test_load_complete_config(self, temp_dir):
+    def test_load_from_yaml_picks_up_file_changes(self, tmp_path):
+        """Test cached YAML is reused until the file changes."""
+        yaml_path = os.path.join(tmp_path, "cached.yaml")
+        with open(yaml_path, "w") as f:
+            f.write("retrieval:\n  top_k: 5\n")
+
+        first = ConfigManager.load_from_yaml(yaml_path)
+        first["retrieval"]["top_k"] = 99  # Mutating a result must not leak into the cache
+        assert ConfigManager.load_from_yaml(yaml_path)["retrieval"]["top_k"] == 5
+
+        with open(yaml_path, "w") as f:
+            f.write("retrieval:\n  top_k: 20\n")
+
+        assert ConfigManager.load_from_yaml(yaml_path)["retrieval"]["top_k"] == 20
+
+    def test_load_complete_config(self, tmp_path):
         """Test loading complete configuration from YAML files."""
         # Create mock YAML files
         model_yaml = """
@@ -84,8 +103,8 @@ report:
 """
 
         # Write files
-        model_path = os.path.join(temp_dir, "model.yaml")
-        pipeline_path = os.path.join(temp_dir, "pipeline.yaml")
+        model_path = os.path.join(tmp_path, "model.yaml")
+        pipeline_path = os.path.join(tmp_path, "pipeline.yaml")
 
         with open(model_path, "w") as f:
             f.write(model_yaml)
@@ -94,7 +113,7 @@ report:
 
         # Load config
         config = ConfigManager.load_config(
-            config_dir=temp_dir,
+            config_dir=tmp_path,
             model_config_file="model.yaml",
             pipeline_config_file="pipeline.yaml",
         )
@@ -106,3 +125,45 @@ report:
         assert config.retrieval.top_k == 15
         assert config.chunking.chunk_size == 1000
         assert "blocker" in config.retrieval.prefilter_keywords
+
+    def test_patched_environment_reaches_config(self, monkeypatch):
+        """Test environment overrides are read when the config is loaded, not at import."""
+        monkeypatch.setenv("REPORT_DIR", "/tmp/patched_reports")
+        monkeypatch.setenv("OPENAI_API_KEY", "patched-key")
+        monkeypatch.setenv("DEBUG_LOGS", "false")
+
+        config = ConfigManager.load_config()
+
+        assert config.report_dir == "/tmp/patched_reports"
+        assert config.openai_api_key == "patched-key"
+        assert config.debug_logs is False
+
+    def test_reload_config_refreshes_environment(self, monkeypatch):
+        """Test reload_config picks up environment changes made after import."""
+        with monkeypatch.context() as m:
+            m.setenv("REPORT_DIR", "/tmp/reloaded_reports")
+            assert reload_config().report_dir == "/tmp/reloaded_reports"
+
+        assert reload_config().report_dir != "/tmp/reloaded_reports"
+
+    def test_retrieval_config_match(self):
+        """Test RetrievalConfig.match finds keywords case-insensitively, longest first."""
+        retrieval = RetrievalConfig(prefilter_keywords=["high priority", "priority", "bug"])
+
+        assert retrieval.match("HIGH PRIORITY Bug, another bug") == ["high priority", "bug"]
+        assert retrieval.match("all good") == []
+        assert RetrievalConfig(prefilter_keywords=[]).match("bug") == []
+
+    def test_flags_config_critical_term_lookup(self):
+        """Test FlagsConfig precomputes a casefolded critical-term set."""
+        flags = FlagsConfig(erb={"critical_terms": ["Blocked", "on hold"]})
+
+        assert flags.is_critical_term("BLOCKED")
+        assert flags.is_critical_term("On Hold")
+        assert not flags.is_critical_term("fine")
+
+    @pytest.mark.skipif(not os.getenv("CI"), reason="libyaml is only required in CI")
+    def test_yaml_loader_uses_libyaml_in_ci(self):
+        """Test CI runs config loading through libyaml's C loader."""
+        assert yaml.__with_libyaml__
+        assert config_module._YAML_LOADER is yaml.CSafeLoader
@@ -3,15 +3,16 @@ Critical tests for data ingestion and parsing functionality.
 Tests the essential parser.py and PII redactor functionality for PoC.
 """
 
+import json
 import os
 
 from src.ingestion.parser import (
+    _write_json,
     normalize_date,
     parse_colleagues,
     parse_recipients,
     parse_single_email,
 )
-from src.ingestion.pii import PIIRedactor
 
 
 class TestNormalizeDate:
@@ -39,13 +40,13 @@ class TestNormalizeDate:
 class TestParseColleagues:
     """Test critical colleagues parsing functionality."""
 
-    def test_parse_colleagues_valid_file(self, temp_dir):
+    def test_parse_colleagues_valid_file(self, tmp_path):
         """Test parsing valid colleagues file."""
         content = """Project Manager (PM): John Smith (john.smith@company.com)
 Developer (DEV): Jane Doe (jane.doe@company.com)
 """
 
-        file_path = os.path.join(temp_dir, "Colleagues.txt")
+        file_path = os.path.join(tmp_path, "Colleagues.txt")
         with open(file_path, "w", encoding="utf-8") as f:
             f.write(content)
 
@@ -83,7 +84,7 @@ class TestParseRecipients:
         assert result[0]["name"] == "John Smith"
         assert result[1]["name"] == "Jane Doe"
 
-    def test_parse_single_email_valid_format(self):
+    def test_parse_single_email_valid_format(self, pii_redactor):
         """Test parsing valid email format."""
         email_content = """From: John Smith <john.smith@company.com>
 To: Jane Doe <jane.doe@company.com>
@@ -95,20 +96,26 @@ This is the email body content.
 
         colleagues = {"john.smith@company.com": {"name": "John Smith", "role": "Developer"}}
 
-        # Create redactor with proper known people for testing
-        known_people = {
-            "john.smith@company.com": {
-                "person_id": "john_smith_developer",
-                "name": "John Smith",
-                "role": "Developer",
-            }
-        }
-        redactor = PIIRedactor(known_people=known_people)
-
-        result = parse_single_email(email_content, colleagues, redactor)
+        result = parse_single_email(email_content, colleagues, pii_redactor)
 
         assert result is not None
         assert result["sender_name"] == "john_smith_developer"
         assert result["sender_email"] == "[EMAIL]"  # PII redacted
         assert result["sender_role"] == "Developer"
         assert result["body"] == "This is the email body content."
+
+
+class TestWriteJson:
+    """Test JSON artifact writing."""
+
+    def test_write_json_roundtrip_keeps_unicode(self, tmp_path):
+        """Test written JSON reloads identically and keeps non-ASCII text readable."""
+        data = [{"id": "chunk_1", "text": "Határidő csúszik", "metadata": {"line_start": 1}}]
+        path = os.path.join(tmp_path, "chunks.json")
+
+        _write_json(path, data)
+
+        with open(path, encoding="utf-8") as f:
+            raw = f.read()
+        assert "Határidő" in raw
+        assert json.loads(raw) == data
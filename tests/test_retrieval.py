@@ -3,10 +3,30 @@ Critical tests for vector store and retrieval functionality.
 Tests the essential VectorStore and HybridRetriever classes for PoC.
 """
 
+import json
+import os
 from unittest.mock import Mock, patch
 
+import numpy as np
+import pytest
+import torch
+
+from src.retrieval import _hf_cache
 from src.retrieval.retriever import HybridRetriever
-from src.retrieval.store import VectorStore
+from src.retrieval.store import (
+    VectorStore,
+    _bucketed_batches,
+    _maybe_compile,
+    _prepare_metadata,
+)
+
+
+@pytest.fixture
+def fresh_hf_cache():
+    """Start and finish with an empty tokenizer/model cache so mocks never leak between tests."""
+    _hf_cache.clear_cache()
+    yield
+    _hf_cache.clear_cache()
 
 
 class TestVectorStore:
@@ -19,10 +39,10 @@ class TestVectorStore:
         assert store.persist_directory == "/tmp/test"
 
     @patch("src.retrieval.store.chromadb.PersistentClient")
-    @patch("src.retrieval.store.AutoTokenizer")
-    @patch("src.retrieval.store.AutoModel")
+    @patch("src.retrieval._hf_cache.AutoTokenizer")
+    @patch("src.retrieval._hf_cache.AutoModel")
     def test_vector_store_initialize_success(
-        self, mock_auto_model, mock_tokenizer, mock_chroma_client
+        self, mock_auto_model, mock_tokenizer, mock_chroma_client, fresh_hf_cache
     ):
         """Test successful VectorStore initialization."""
         # Setup mocks
@@ -45,6 +65,73 @@ class TestVectorStore:
         assert store.collection is not None
         assert store.embedding_model is not None
 
+        metadata = mock_client_instance.get_or_create_collection.call_args.kwargs["metadata"]
+        assert metadata["hnsw:space"] == "cosine"
+        assert metadata["hnsw:M"] == 16
+
+    @patch("src.retrieval._hf_cache.AutoModel")
+    def test_load_model_uses_bf16_weights_on_cuda(self, mock_auto_model, fresh_hf_cache):
+        """Test embedding weights load natively in bf16 on CUDA and fp32 elsewhere."""
+        _hf_cache.load_model("model", torch.device("cuda"))
+        _hf_cache.load_model("model", torch.device("cpu"))
+
+        dtypes = [c.kwargs["torch_dtype"] for c in mock_auto_model.from_pretrained.call_args_list]
+        assert dtypes == [torch.bfloat16, torch.float32]
+
+    @patch("src.retrieval._hf_cache.AutoModel")
+    def test_load_model_freezes_weights(self, mock_auto_model, fresh_hf_cache):
+        """Test the shared embedding model is in eval mode with gradients disabled."""
+        mock_auto_model.from_pretrained.return_value = torch.nn.Linear(2, 2)
+
+        model = _hf_cache.load_model("model", torch.device("cpu"))
+
+        assert not model.training
+        assert not any(p.requires_grad for p in model.parameters())
+
+    @patch("src.retrieval._hf_cache.ORTModelForFeatureExtraction")
+    def test_onnx_backend_exports_once(self, mock_ort_model, fresh_hf_cache, tmp_path):
+        """Test the ONNX backend exports on first use and reloads the saved graph afterwards."""
+        onnx_dir = tmp_path / "onnx" / "org--model"
+        mock_ort_model.from_pretrained.return_value.save_pretrained.side_effect = lambda path: (
+            path.mkdir(parents=True),
+            (path / "model.onnx").touch(),
+        )
+
+        _hf_cache.load_embedding_model("org/model", torch.device("cpu"), "onnx", str(tmp_path))
+        _hf_cache.clear_cache()
+        _hf_cache.load_embedding_model("org/model", torch.device("cpu"), "onnx", str(tmp_path))
+
+        first, second = mock_ort_model.from_pretrained.call_args_list
+        assert first.args == ("org/model",)
+        assert first.kwargs["export"] is True
+        assert first.kwargs["provider"] == "CPUExecutionProvider"
+        assert second.args == (onnx_dir,)
+
+    @pytest.mark.parametrize(
+        "backend, expected", [("hf", "mps"), ("onnx", "cpu"), ("tensorrt", "cpu")]
+    )
+    def test_resolve_device_keeps_ort_inputs_off_mps(self, monkeypatch, backend, expected):
+        """Test ONNX Runtime backends never place inputs on MPS, which they cannot read."""
+        monkeypatch.setattr(torch.cuda, "is_available", lambda: False)
+        monkeypatch.setattr(torch.backends.mps, "is_available", lambda: True)
+
+        assert _hf_cache.resolve_device(backend).type == expected
+
+    @patch("src.retrieval._hf_cache.ORTModelForFeatureExtraction")
+    def test_tensorrt_backend_falls_back_to_cpu_provider(
+        self, mock_ort_model, fresh_hf_cache, tmp_path
+    ):
+        """Test the TensorRT backend uses the CPU provider when there is no CUDA device."""
+        _hf_cache.load_embedding_model("model", torch.device("cpu"), "tensorrt", str(tmp_path))
+
+        provider = mock_ort_model.from_pretrained.call_args.kwargs["provider"]
+        assert provider == "CPUExecutionProvider"
+
+    def test_unknown_embedding_backend_rejected(self):
+        """Test an unknown backend name fails fast."""
+        with pytest.raises(ValueError, match="Unknown embedding backend"):
+            _hf_cache.load_embedding_model("model", torch.device("cpu"), "tpu", ".vectorstore")
+
     def test_compute_chunk_hash(self):
         """Test chunk hash computation."""
         store = VectorStore()
@@ -60,6 +147,166 @@ class TestVectorStore:
         assert hash1 == hash2
         assert isinstance(hash1, str)
         assert len(hash1) == 16  # SHA-256 truncated to 16 characters
+        assert store.compute_chunk_hashes([chunk, {"text": "other"}])[0] == hash1
+
+    def test_generate_embeddings_preserves_input_order(self):
+        """Test tokenize-once, length-bucketed embedding returns vectors in input order."""
+        store = VectorStore()
+
+        tokenizer_calls = []
+
+        def fake_tokenizer(texts, **kwargs):
+            tokenizer_calls.append(texts)
+            return {"input_ids": [[len(t)] * len(t) for t in texts]}
+
+        def fake_model(input_ids, attention_mask):
+            return Mock(last_hidden_state=input_ids.float().unsqueeze(-1).expand(-1, -1, 3))
+
+        store.tokenizer = fake_tokenizer
+        store.embedding_model = fake_model
+
+        texts = ["long text here", "a", "  ", "medium", "ab"]
+        result = store.generate_embeddings(texts, embed_batch_size=2)
+
+        assert result.shape == (len(texts), 3)
+        assert result.dtype == np.float32 and result.flags["C_CONTIGUOUS"]
+        # Masked mean pooling of the fake states yields each text's own length;
+        # the whitespace-only text is never embedded and gets a zero vector.
+        assert result[:, 0].tolist() == [14.0, 1.0, 0.0, 6.0, 2.0]
+        # All non-empty texts are tokenized in a single call, then sliced into batches
+        assert tokenizer_calls == [["long text here", "a", "medium", "ab"]]
+
+    def test_bucketed_batches_respects_token_budget(self):
+        """Test length-sorted batches stay within both the size cap and the padded-token budget."""
+        lengths = [10, 2, 3, 50, 2, 9]
+
+        batches = _bucketed_batches(lengths, max_batch_size=3, max_tokens_per_batch=30)
+
+        assert [b.tolist() for b in batches] == [[1, 4, 2], [5, 0], [3]]
+        for batch in batches:
+            assert len(batch) * max(lengths[i] for i in batch) <= 30 or len(batch) == 1
+
+    @pytest.mark.parametrize("disabled", [False, True])
+    def test_maybe_compile_once_per_model(self, monkeypatch, disabled):
+        """Test CUDA models are compiled once per process unless DISABLE_TORCH_COMPILE is set."""
+        compile_mock = Mock(side_effect=lambda model, **_: ("compiled", model))
+        monkeypatch.setattr(torch, "compile", compile_mock)
+        if disabled:
+            monkeypatch.setenv("DISABLE_TORCH_COMPILE", "1")
+        _maybe_compile.cache_clear()
+        model = torch.nn.Linear(2, 2)
+        cuda = torch.device("cuda")
+
+        first = _maybe_compile(model, cuda)
+        second = _maybe_compile(model, cuda)
+        _maybe_compile.cache_clear()
+
+        assert first is second
+        assert compile_mock.call_count == (0 if disabled else 1)
+        assert (first is model) == disabled
+
+    @patch("src.retrieval.store.chromadb.PersistentClient")
+    @patch("src.retrieval.store.load_tokenizer")
+    @patch("src.retrieval.store.load_embedding_model")
+    @patch("src.retrieval.store._maybe_compile")
+    def test_compiled_model_warms_up_once(
+        self, mock_compile, mock_load_model, mock_load_tokenizer, mock_chroma_client
+    ):
+        """Test the shared compiled model is warmed up by the first initialize() only."""
+        mock_compile.return_value = Mock(spec=[])
+
+        with patch.object(VectorStore, "generate_embeddings") as mock_embed:
+            VectorStore().initialize()
+            VectorStore().initialize()
+
+        mock_embed.assert_called_once_with(["warmup"])
+
+    def test_iter_chunks_json_fallback_matches_ijson(self, tmp_path, monkeypatch):
+        """Test the json.load fallback yields the same chunks as the ijson streaming path."""
+        chunks = [
+            {"id": f"chunk_{i}", "text": f"text {i}", "metadata": {"score": i / 2}}
+            for i in range(3)
+        ]
+        chunks_file = tmp_path / "chunks.json"
+        chunks_file.write_text(json.dumps(chunks), encoding="utf-8")
+        store = VectorStore()
+
+        streamed = list(store.iter_chunks(str(chunks_file)))
+        monkeypatch.setattr("src.retrieval.store.ijson", None)
+        loaded = list(store.iter_chunks(str(chunks_file)))
+
+        assert streamed == loaded == chunks
+
+    def test_store_chunks_streams_from_file(self, tmp_path):
+        """Test chunks are streamed from chunks.json and stored batch by batch."""
+        chunks = [
+            {"id": f"chunk_{i}", "text": f"text {i}", "metadata": {"participants": ["a", "b"]}}
+            for i in range(5)
+        ]
+        chunks_file = os.path.join(tmp_path, "chunks.json")
+        with open(chunks_file, "w", encoding="utf-8") as f:
+            json.dump(chunks, f)
+
+        store = VectorStore()
+        store.generate_embeddings = Mock(side_effect=lambda texts, **_: [[0.0]] * len(texts))
+        store.upsert_batch = Mock()
+
+        stored = store.store_chunks(store.iter_chunks(chunks_file), batch_size=2)
+
+        assert stored == 5
+        assert store.upsert_batch.call_count == 3
+        first_call = store.upsert_batch.call_args_list[0].kwargs
+        assert first_call["ids"] == ["chunk_0", "chunk_1"]
+        assert first_call["metadatas"][0]["participants"] == "a, b"
+
+    def test_store_chunks_skips_existing_ids(self):
+        """Test skip_existing embeds only chunks not yet stored, once per id."""
+        chunks = [
+            {"id": chunk_id, "text": f"text {chunk_id}", "metadata": {}}
+            for chunk_id in ["a", "b", "b", "c", "d"]
+        ]
+        store = VectorStore()
+        store.collection = Mock()
+        store.collection.get.side_effect = [{"ids": ["a"]}, {"ids": ["d"]}]
+        store.generate_embeddings = Mock(side_effect=lambda texts, **_: [[0.0]] * len(texts))
+        store.upsert_batch = Mock()
+
+        stored = store.store_chunks(chunks, batch_size=3, skip_existing=True)
+
+        assert stored == 2
+        store.collection.get.assert_any_call(ids=["a", "b", "b"], include=[])
+        assert [c.kwargs["ids"] for c in store.upsert_batch.call_args_list] == [["b"], ["c"]]
+
+    def test_prepare_metadata_flattens_for_chroma(self):
+        """Test metadata lists are joined and unsupported values stringified."""
+        prepared = _prepare_metadata(
+            {
+                "participants": ["a@x.com", "b@x.com"],
+                "line_start": 1,
+                "mixed": ["a", 2],
+                "nested": {"k": "v"},
+                "missing": None,
+            }
+        )
+
+        assert prepared["participants"] == "a@x.com, b@x.com"
+        assert prepared["line_start"] == 1
+        assert prepared["mixed"] == "a, 2"
+        assert prepared["nested"] == "{'k': 'v'}"
+        assert prepared["missing"] is None
+
+    def test_upsert_batch_without_documents(self):
+        """Test embedding-only upserts leave raw text out of the collection."""
+        store = VectorStore(store_documents=False)
+        store.collection = Mock()
+
+        store.upsert_batch(
+            ids=["chunk_1"], texts=["text"], metadatas=[{"file": "a.txt"}], embeddings=[[0.1]]
+        )
+
+        kwargs = store.collection.upsert.call_args.kwargs
+        assert "documents" not in kwargs
+        assert kwargs["ids"] == ["chunk_1"]
 
     def test_get_collection_info_empty_collection(self):
         """Test getting collection info from empty collection."""
@@ -90,10 +337,10 @@ class TestHybridRetriever:
         assert "blocker" in retriever.prefilter_keywords
 
     @patch("src.retrieval.retriever.chromadb.PersistentClient")
-    @patch("src.retrieval.retriever.AutoTokenizer")
-    @patch("src.retrieval.retriever.AutoModel")
+    @patch("src.retrieval._hf_cache.AutoTokenizer")
+    @patch("src.retrieval._hf_cache.AutoModel")
     def test_hybrid_retriever_initialize_success(
-        self, mock_auto_model, mock_tokenizer, mock_chroma_client
+        self, mock_auto_model, mock_tokenizer, mock_chroma_client, fresh_hf_cache
     ):
         """Test successful HybridRetriever initialization."""
         # Setup mocks
@@ -115,6 +362,23 @@ class TestHybridRetriever:
         assert retriever.client is not None
         assert retriever.collection is not None
 
+    @patch("src.retrieval.retriever.chromadb.PersistentClient")
+    @patch("src.retrieval.store.chromadb.PersistentClient")
+    @patch("src.retrieval._hf_cache.AutoTokenizer")
+    @patch("src.retrieval._hf_cache.AutoModel")
+    def test_store_and_retriever_share_loaded_model(
+        self, mock_auto_model, mock_tokenizer, _store_client, _retriever_client, fresh_hf_cache
+    ):
+        """Test the embedding model and tokenizer are loaded once per process."""
+        store = VectorStore()
+        store.initialize()
+        retriever = HybridRetriever()
+        retriever.initialize()
+
+        mock_auto_model.from_pretrained.assert_called_once()
+        mock_tokenizer.from_pretrained.assert_called_once()
+        assert retriever.tokenizer is store.tokenizer
+
     def test_keyword_prefilter_with_matches(self):
         """Test keyword prefiltering with matching keywords."""
         retriever = HybridRetriever(prefilter_keywords=["blocker", "urgent"])
@@ -134,12 +398,144 @@ class TestHybridRetriever:
         result = retriever.keyword_prefilter("find issues")
         assert len(result) > 0
 
-    def test_retrieve_with_prefilter(self):
-        """Test retrieve method with keyword prefiltering."""
+    def test_keyword_prefilter_matches_query_terms_and_keywords(self):
+        """Test prefilter keeps documents matching either a query term or a keyword."""
+        retriever = HybridRetriever(prefilter_keywords=["blocker"])
+        retriever.collection = Mock()
+        retriever.collection.get.return_value = {
+            "documents": ["Login BLOCKER found", "Payment delayed", "Nothing here", None],
+            "ids": ["chunk_1", "chunk_2", "chunk_3", "chunk_4"],
+        }
+
+        assert retriever.keyword_prefilter("Payment status") == ["chunk_1", "chunk_2"]
+
+    def test_keyword_prefilter_pages_documents_and_caches(self, monkeypatch):
+        """Test prefilter pages through the collection without metadatas and reuses the scan."""
+        monkeypatch.setattr("src.retrieval.retriever.PREFILTER_PAGE_SIZE", 2)
+        retriever = HybridRetriever(prefilter_keywords=["blocker"])
+        retriever.collection = Mock()
+        retriever.collection.count.return_value = 3
+        retriever.collection.get.side_effect = [
+            {"ids": ["chunk_1", "chunk_2"], "documents": ["a blocker", "fine"]},
+            {"ids": ["chunk_3"], "documents": ["another blocker"]},
+        ]
+
+        assert retriever.keyword_prefilter("status") == ["chunk_1", "chunk_3"]
+        assert retriever.keyword_prefilter("status") == ["chunk_1", "chunk_3"]
+
+        assert retriever.collection.get.call_count == 2
+        for call, offset in zip(retriever.collection.get.call_args_list, [0, 2], strict=True):
+            assert call.kwargs == {"include": ["documents"], "limit": 2, "offset": offset}
+
+    def test_keyword_prefilter_rescans_after_write(self):
+        """Test a same-count upsert in this process invalidates the cached documents."""
+        retriever = HybridRetriever(prefilter_keywords=["blocker"])
+        retriever.collection = Mock()
+        retriever.collection.count.return_value = 1
+        retriever.collection.get.side_effect = [
+            {"ids": ["chunk_1"], "documents": ["old text"]},
+            {"ids": ["chunk_1"], "documents": ["new blocker text"]},
+        ]
+        assert retriever.keyword_prefilter("status") == []
+
+        store = VectorStore()
+        store.collection = Mock()
+        store.upsert_batch(
+            ids=["chunk_1"], texts=["new blocker text"], metadatas=[{}], embeddings=[[0.1]]
+        )
+
+        assert retriever.keyword_prefilter("status") == ["chunk_1"]
+
+    def test_semantic_search_caches_embedding(self):
+        """Test repeated queries reuse the cached embedding instead of re-running the model."""
+        retriever = HybridRetriever()
+        retriever.collection = Mock()
+        retriever.collection.query.return_value = {
+            "ids": [[]],
+            "documents": [[]],
+            "metadatas": [[]],
+            "distances": [[]],
+        }
+        retriever.tokenizer = Mock(return_value={"input_ids": torch.ones((1, 3), dtype=torch.long)})
+        retriever.embedding_model = Mock(
+            return_value=Mock(last_hidden_state=torch.full((1, 3, 4), 0.5))
+        )
+
+        retriever.semantic_search("find blockers")
+        retriever.semantic_search("  find   blockers ")
+
+        retriever.embedding_model.assert_called_once()
+        for call in retriever.collection.query.call_args_list:
+            assert call.kwargs["query_embeddings"] == [[0.5, 0.5, 0.5, 0.5]]
+
+    def test_semantic_search_ranks_candidates_by_cosine(self):
+        """Test candidate ids are scored exactly against their stored embeddings."""
+        retriever = HybridRetriever()
+        retriever.collection = Mock()
+        retriever.generate_query_embedding = Mock(return_value=[2.0, 0.0])
+        retriever.collection.get.return_value = {
+            "ids": ["chunk_1", "chunk_2", "chunk_3"],
+            "documents": ["doc 1", "doc 2", "doc 3"],
+            "metadatas": [{"n": 1}, {"n": 2}, {"n": 3}],
+            "embeddings": [[0.0, 1.0], [3.0, 0.0], [1.0, 1.0]],
+        }
+
+        results = retriever.semantic_search(
+            "find blockers", candidate_ids=["chunk_1", "chunk_2", "chunk_3"], top_k=2
+        )
+
+        retriever.collection.query.assert_not_called()
+        assert [r["id"] for r in results] == ["chunk_2", "chunk_3"]
+        assert [r["rank"] for r in results] == [1, 2]
+        assert results[0]["score"] == pytest.approx(1.0)
+        assert results[1]["score"] == pytest.approx(2**-0.5)
+        assert results[1]["metadata"] == {"n": 3}
+
+    def test_semantic_search_large_candidate_set_stays_in_chroma(self, monkeypatch):
+        """Test candidate sets above the cap use an id-filtered index query, not a bulk get."""
+        monkeypatch.setattr("src.retrieval.retriever.MAX_EXACT_CANDIDATES", 2)
+        retriever = HybridRetriever()
+        retriever.collection = Mock()
+        retriever.generate_query_embedding = Mock(return_value=[1.0, 0.0])
+        retriever.collection.query.return_value = {
+            "ids": [["chunk_3"]],
+            "documents": [["doc 3"]],
+            "metadatas": [[{}]],
+            "distances": [[0.25]],
+        }
+        candidates = ["chunk_1", "chunk_2", "chunk_3"]
+
+        results = retriever.semantic_search("find blockers", candidate_ids=candidates, top_k=1)
+
+        retriever.collection.get.assert_not_called()
+        assert retriever.collection.query.call_args.kwargs["ids"] == candidates
+        assert [r["id"] for r in results] == ["chunk_3"]
+        assert results[0]["score"] == pytest.approx(0.75)
+
+    def test_retrieve_without_prefilter_skips_thread_pool(self):
+        """Test retrieve searches the index directly when there are no prefilter keywords."""
+        retriever = HybridRetriever()
+        retriever.prefilter_keywords = []
+        retriever.semantic_search = Mock(return_value=[])
+
+        with patch("src.retrieval.retriever.ThreadPoolExecutor") as mock_pool:
+            assert retriever.retrieve("find blockers", top_k=3) == []
+
+        mock_pool.assert_not_called()
+        retriever.semantic_search.assert_called_once_with(
+            "find blockers", candidate_ids=None, top_k=3
+        )
+
+    @pytest.mark.parametrize(
+        "candidates, expected_ids", [(["chunk_1", "chunk_2"], ["chunk_1", "chunk_2"]), ([], None)]
+    )
+    def test_retrieve_with_prefilter(self, candidates, expected_ids):
+        """Test retrieve ranks the prefilter candidates, or searches the index without any."""
         retriever = HybridRetriever(prefilter_keywords=["blocker"])
 
         # Mock the internal methods
-        retriever.keyword_prefilter = Mock(return_value=["chunk_1", "chunk_2"])
+        retriever.generate_query_embedding = Mock(return_value=[1.0, 0.0])
+        retriever.keyword_prefilter = Mock(return_value=candidates)
         retriever.semantic_search = Mock(
             return_value=[
                 {
@@ -153,5 +549,12 @@ class TestHybridRetriever:
 
         result = retriever.retrieve("find blockers", top_k=5)
 
+        # The query embedding is computed alongside the prefilter scan
+        retriever.generate_query_embedding.assert_called_once_with("find blockers")
+        retriever.keyword_prefilter.assert_called_once_with("find blockers")
+        retriever.semantic_search.assert_called_once_with(
+            "find blockers", candidate_ids=expected_ids, top_k=5
+        )
         assert len(result) == 1
         assert result[0]["id"] == "chunk_1"
+        assert result[0]["rank"] == 1
@@ -0,0 +1,48 @@
+"""
+Smoke tests - basic functionality verification for the CI pipeline.
+Tests core imports and basic functionality without heavy dependencies or network calls.
+"""
+
+import importlib.util
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+pytestmark = pytest.mark.smoke
+
+CORE_MODULES = [
+    "src.ingestion.parser",
+    "src.ingestion.pii",
+    "src.retrieval.retriever",
+    "src.retrieval.store",
+    "src.services.config",
+]
+
+
+def test_imports():
+    """Test that core modules can be found."""
+    # Probe the core modules concurrently; find_spec does not execute them
+    with ThreadPoolExecutor(max_workers=len(CORE_MODULES)) as pool:
+        specs = list(pool.map(importlib.util.find_spec, CORE_MODULES))
+
+    missing = [name for name, spec in zip(CORE_MODULES, specs, strict=True) if not spec]
+    assert not missing, f"Modules not found: {missing}"
+
+
+def test_config_loading():
+    """Test configuration loading."""
+    from src.services.config import get_config
+
+    config = get_config()
+    assert config.model.chat_model
+
+
+def test_basic_functionality():
+    """Test date normalization and PII redactor creation."""
+    from src.ingestion.parser import normalize_date
+    from src.ingestion.pii import PIIRedactor
+
+    result = normalize_date("Wed, 15 Jan 2024 10:30:00 +0000")
+    assert "normalized_date" in result
+
+    PIIRedactor()  # Test that it can be instantiated